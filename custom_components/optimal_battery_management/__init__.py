@@ -1,4 +1,3 @@
-from homeassistant.helpers.discovery import async_load_platform
 import logging
 
 _LOGGER = logging.getLogger(__name__)
@@ -16,6 +15,9 @@ async def async_setup(hass, config):
     hass.data[DOMAIN] = config[DOMAIN]
     _LOGGER.debug("Loaded configuration: %s", config[DOMAIN])
 
+    # Pas hier importeren, zodat de optimizer ook zonder Home Assistant te gebruiken is
+    from homeassistant.helpers.discovery import async_load_platform
+
     # Laad de sensor en geef de configuratie door
     await async_load_platform(hass, "sensor", DOMAIN, config[DOMAIN], config)
     return True
@@ -0,0 +1,134 @@
+"""Compute schedules for many sites in one batch, without Home Assistant.
+
+Reads one site per line (JSON) and writes one result per line:
+
+    python -m custom_components.optimal_battery_management.batch sites.ndjson > schedules.ndjson
+
+A site line contains the configuration.yaml options plus the inputs:
+
+    {"site": "home-1", "time_zone": "Europe/Amsterdam", "soc": 45, "max_capacity": 5.12,
+     "charge_rate": 1.0, "discharge_rate": 2.0, "avg_charge_price": 0.21,
+     "now": "2026-10-19T06:00:00+00:00", "forecast": [{"datetime": "...Z", "electricity_price": 2153000}]}
+
+`power_curve` (the attribute of sensor.optimal_battery_management) and
+`marginal_cost` (attribute of sensor.average_charge_price) are optional.
+Forecast items with `"estimated": true` are penalised by `estimate_margin`.
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from zoneinfo import ZoneInfo
+
+from .forecast import MAX_HORIZON_HOURS, parse_forecast_time
+from .optimizer import calculate_optimal_schedule
+from .power_curve import PowerCurve
+
+_LOGGER = logging.getLogger(__name__)
+
+
+def compute_site(site):
+    """Calculate the schedule for one site config, errors are returned instead of raised."""
+    site_id = site.get("site") if isinstance(site, dict) else None
+    try:
+        time_zone = site.get("time_zone", "Europe/Amsterdam")
+        local_tz = ZoneInfo(time_zone)
+        max_capacity = site.get("max_capacity", 5.12)
+        forecast = sorted(
+            ({**item, "datetime": parse_forecast_time(item["datetime"], local_tz)} for item in site["forecast"]),
+            key=lambda item: item["datetime"],
+        )
+        now = datetime.fromisoformat(site["now"]) if site.get("now") else None
+        charge_rate = site.get("charge_rate", 0.8)
+        discharge_rate = site.get("discharge_rate", 0.8)
+        power_curve = (
+            PowerCurve.from_dict(site["power_curve"], charge_rate, discharge_rate) if site.get("power_curve") else None
+        )
+
+        schedule = calculate_optimal_schedule(
+            forecast,
+            max_capacity * site["soc"] / 100.0,
+            max_capacity,
+            charge_rate,
+            discharge_rate,
+            site.get("depreciation_per_kwh", 0.065),
+            site.get("min_profit", 0.05),
+            time_zone,
+            horizon_hours=min(max(site.get("horizon_hours", 11), 1), MAX_HORIZON_HOURS),
+            reserve_kwh=site.get("reserve_kwh", 0.0),
+            avg_charge_price=site.get("avg_charge_price", 0.0),
+            marginal_cost=site.get("marginal_cost"),
+            estimate_margin=site.get("estimate_margin", 0.0),
+            now=now,
+            power_curve=power_curve,
+        )
+    except Exception as e:  # Eén kapotte site mag de batch niet stoppen
+        return {"site": site_id, "error": f"{type(e).__name__}: {e}"}
+
+    return {
+        "site": site_id,
+        "schedule": [{**period, "time": period["time"].isoformat()} for period in schedule],
+    }
+
+
+def _init_worker(log_level):
+    logging.basicConfig(level=log_level)
+
+
+def run_batch(sites, workers=None, max_pending=None, log_level=logging.ERROR):
+    """Yield a result per site, in input order, using a process pool.
+
+    `sites` may be a lazy iterable; at most `max_pending` sites are in flight
+    so memory stays flat for large fleets.
+    """
+    workers = workers or os.cpu_count() or 1
+    max_pending = max_pending or workers * 4
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(log_level,)) as executor:
+        pending = deque()
+        for site in sites:
+            pending.append(executor.submit(compute_site, site))
+            if len(pending) >= max_pending:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def _read_sites(file):
+    for line_number, line in enumerate(file, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            site = json.loads(line)
+        except json.JSONDecodeError as e:
+            _LOGGER.error(f"Skipping line {line_number}: {e}")
+            continue
+        if not isinstance(site, dict):
+            _LOGGER.error(f"Skipping line {line_number}: expected a JSON object, got {type(site).__name__}")
+            continue
+        yield site
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Batch-compute optimal battery schedules (NDJSON in, NDJSON out)")
+    parser.add_argument("input", nargs="?", default="-", help="site configs, one JSON object per line (default: stdin)")
+    parser.add_argument("--workers", type=int, default=None, help="number of processes (default: CPU count)")
+    parser.add_argument("--log-level", default="ERROR")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=args.log_level)
+    file = sys.stdin if args.input == "-" else open(args.input, encoding="utf-8")
+    try:
+        for result in run_batch(_read_sites(file), args.workers, log_level=args.log_level):
+            sys.stdout.write(json.dumps(result) + "\n")
+    finally:
+        if file is not sys.stdin:
+            file.close()
+
+
+if __name__ == "__main__":
+    main()
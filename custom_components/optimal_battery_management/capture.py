@@ -0,0 +1,130 @@
+"""Append-only binary log of the inputs the integration consumes."""
+import logging
+import math
+import os
+import struct
+import threading
+from zoneinfo import ZoneInfo
+
+from .forecast import parse_forecast_time
+
+_LOGGER = logging.getLogger(__name__)
+
+# Vast record van 24 bytes: tijdstip (epoch s), soort, aux (epoch s van een forecast-blok), waarde
+RECORD = struct.Struct("<dB3xId")
+
+KIND_TARIFF = 1
+KIND_SOC = 2
+KIND_POWER = 3
+KIND_FORECAST = 4  # aux = aantal KIND_FORECAST_SLOT records dat volgt
+KIND_FORECAST_SLOT = 5  # aux = starttijd van het blok, waarde = electricity_price
+
+_UTC = ZoneInfo("UTC")
+
+
+def state_to_value(state):
+    """Encode a state string as float, unknown/unavailable become NaN."""
+    try:
+        return float(state)
+    except (TypeError, ValueError):
+        return math.nan
+
+
+class InputRecorder:
+    """Buffer fixed-size input records in memory and append them to a rotating file."""
+
+    def __init__(self, path, max_bytes=16 * 1024 * 1024, backups=3, flush_bytes=64 * 1024):
+        self.path = path
+        self._max_bytes = max_bytes
+        self._backups = backups
+        self.flush_bytes = flush_bytes
+        self._buffer = bytearray()
+        self._lock = threading.Lock()  # Alleen voor de buffer, record() draait in de event loop
+        self._file_lock = threading.Lock()  # Houdt gelijktijdige flushes op volgorde
+        self._last_forecast = None
+        # Laatst weggeschreven invoer, voor de kop van een nieuw bestand na rotatie (alleen flush() gebruikt deze)
+        self._file_inputs = {}  # soort -> waarde
+        self._file_forecast = None  # [(blokstart, prijs)]
+        self.records = 0
+
+    @property
+    def pending_bytes(self):
+        return len(self._buffer)
+
+    def record(self, timestamp, kind, value, aux=0):
+        """Append one record to the in-memory buffer."""
+        with self._lock:
+            self._buffer += RECORD.pack(timestamp, kind, aux, value)
+            self.records += 1
+
+    def record_state(self, timestamp, kind, state):
+        self.record(timestamp, kind, state_to_value(state))
+
+    def record_forecast(self, timestamp, forecast):
+        """Record the forecast attribute, only when it differs from the last recorded one."""
+        if forecast == self._last_forecast:
+            return
+        self._last_forecast = [dict(item) for item in forecast]
+
+        records = []
+        for item in forecast:
+            try:
+                start = parse_forecast_time(item["datetime"], _UTC)
+                records.append(RECORD.pack(timestamp, KIND_FORECAST_SLOT, int(start.timestamp()), item["electricity_price"]))
+            except (KeyError, TypeError, ValueError) as e:
+                _LOGGER.debug(f"Not capturing forecast item {item}: {e}")
+        with self._lock:
+            self._buffer += RECORD.pack(timestamp, KIND_FORECAST, len(records), math.nan)
+            self._buffer += b"".join(records)
+            self.records += len(records) + 1
+
+    def flush(self):
+        """Write the buffered records to disk. Blocking, run in an executor."""
+        with self._file_lock:
+            # Buffer omwisselen onder de lock, de schijf-I/O daarbuiten
+            with self._lock:
+                if not self._buffer:
+                    return
+                data, self._buffer = self._buffer, bytearray()
+            try:
+                if os.path.exists(self.path) and os.path.getsize(self.path) + len(data) > self._max_bytes:
+                    self._rotate()
+                    data = self._snapshot(RECORD.unpack_from(data)[0]) + data
+                with open(self.path, "ab") as file:
+                    file.write(data)
+            except OSError as e:
+                _LOGGER.error(f"Failed to write input capture to {self.path}: {e}")
+            self._remember(data)
+
+    def _remember(self, data):
+        """Keep the last tariff, SoC, power and forecast written to the file."""
+        for _timestamp, kind, aux, value in RECORD.iter_unpack(data):
+            if kind == KIND_FORECAST:
+                self._file_forecast = []
+            elif kind == KIND_FORECAST_SLOT:
+                if self._file_forecast is not None:
+                    self._file_forecast.append((aux, value))
+            else:
+                self._file_inputs[kind] = value
+
+    def _snapshot(self, timestamp):
+        """Records with the last known inputs, so a new file can be replayed on its own."""
+        records = [
+            RECORD.pack(timestamp, kind, 0, self._file_inputs[kind])
+            for kind in (KIND_TARIFF, KIND_SOC, KIND_POWER) if kind in self._file_inputs
+        ]
+        if self._file_forecast is not None:
+            records.append(RECORD.pack(timestamp, KIND_FORECAST, len(self._file_forecast), math.nan))
+            records.extend(RECORD.pack(timestamp, KIND_FORECAST_SLOT, aux, value) for aux, value in self._file_forecast)
+        return b"".join(records)
+
+    def _rotate(self):
+        # capture.bin -> capture.bin.1 -> capture.bin.2 ... oudste vervalt, flush() zet de laatste invoer vooraan
+        for index in range(self._backups - 1, 0, -1):
+            source = f"{self.path}.{index}"
+            if os.path.exists(source):
+                os.replace(source, f"{self.path}.{index + 1}")
+        if self._backups > 0:
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
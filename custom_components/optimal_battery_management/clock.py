@@ -0,0 +1,37 @@
+"""Time source for the sensors, replaced by a VirtualClock in replay and simulation."""
+from datetime import datetime, timedelta, timezone
+
+DATA_CLOCK = "optimal_battery_management_clock"  # Sleutel in hass.data
+
+
+class SystemClock:
+    """Wall-clock time."""
+
+    def now(self, tz=timezone.utc):
+        return datetime.now(tz)
+
+
+class VirtualClock:
+    """Clock that only moves when told to."""
+
+    def __init__(self, start):
+        if start.tzinfo is None:
+            raise ValueError("VirtualClock needs a timezone-aware start time")
+        self._now = start.astimezone(timezone.utc)
+
+    def now(self, tz=timezone.utc):
+        return self._now.astimezone(tz)
+
+    def set(self, when):
+        self._now = when.astimezone(timezone.utc)
+
+    def advance(self, seconds):
+        self._now += timedelta(seconds=seconds)
+
+
+SYSTEM_CLOCK = SystemClock()
+
+
+def get_clock(hass):
+    """Return the clock injected in hass.data, or the system clock."""
+    return hass.data.get(DATA_CLOCK, SYSTEM_CLOCK)
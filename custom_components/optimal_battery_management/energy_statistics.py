@@ -0,0 +1,148 @@
+"""Hourly energy, cost and revenue buckets written as long-term statistics."""
+import logging
+import threading
+from datetime import datetime
+from zoneinfo import ZoneInfo
+
+_LOGGER = logging.getLogger(__name__)
+
+DOMAIN = "optimal_battery_management"
+
+# statistic-sleutel: (naam, eenheid)
+SERIES = {
+    "charged_energy": ("Battery charged energy", "kWh"),
+    "discharged_energy": ("Battery discharged energy", "kWh"),
+    "charge_cost": ("Battery charge cost", "EUR"),
+    "discharge_revenue": ("Battery discharge revenue", "EUR"),
+    "degradation_cost": ("Battery degradation cost", "EUR"),
+}
+
+_UTC = ZoneInfo("UTC")
+
+
+def _hour_start(when):
+    return when.astimezone(_UTC).replace(minute=0, second=0, microsecond=0)
+
+
+class HourlyEnergyStatistics:
+    """Aggregate charge and discharge samples into hourly in-memory buckets."""
+
+    def __init__(self, depreciation_per_kwh, batch_hours=1):
+        self._depreciation_per_kwh = depreciation_per_kwh
+        self._batch_hours = batch_hours  # Pas wegschrijven als er zoveel uren klaarstaan
+        self._lock = threading.Lock()  # Laad- en ontlaadsensor draaien in verschillende threads
+        self._hour = None
+        self._bucket = dict.fromkeys(SERIES, 0.0)
+        self._closed = []  # [(uur, bucket)], wachten om weggeschreven te worden
+        self._sums = None  # Cumulatieve sommen per serie, geladen uit de recorder
+        self._last_written = {}  # statistic-sleutel -> laatst weggeschreven uur
+        self._last_state = {}  # statistic-sleutel -> state van dat uur, om een deels geschreven uur aan te vullen
+
+    def _add(self, when, values):
+        hour = _hour_start(when)
+        with self._lock:
+            if hour != self._hour:
+                self._close()
+                self._hour = hour
+            for key, value in values.items():
+                self._bucket[key] += value
+
+    def _close(self):
+        if self._hour is not None and any(self._bucket.values()):
+            self._closed.append((self._hour, self._bucket))
+        self._bucket = dict.fromkeys(SERIES, 0.0)
+
+    def add_charge(self, when, energy_kwh, cost):
+        self._add(when, {"charged_energy": energy_kwh, "charge_cost": cost})
+
+    def add_discharge(self, when, energy_kwh, revenue):
+        self._add(when, {
+            "discharged_energy": energy_kwh,
+            "discharge_revenue": revenue,
+            "degradation_cost": energy_kwh * self._depreciation_per_kwh,
+        })
+
+    def take_closed(self, now, minimum=1, force=False):
+        """Return the finished hours once at least `minimum` are waiting, and clear them.
+
+        With `force` the current hour is closed as well, so a partial hour is
+        returned; later samples of that hour start a new bucket for it.
+        """
+        with self._lock:
+            if self._hour is not None and (force or _hour_start(now) > self._hour):
+                self._close()
+                self._hour = None
+            if len(self._closed) < minimum:
+                return []
+            closed, self._closed = self._closed, []
+        return closed
+
+    async def async_flush(self, hass, now, force=False):
+        """Write the finished hours to the recorder as external statistics, one batch per series."""
+        from homeassistant.components.recorder import get_instance
+        from homeassistant.components.recorder.statistics import (
+            async_add_external_statistics,
+            get_last_statistics,
+        )
+
+        closed = self.take_closed(now, 1 if force else self._batch_hours, force)
+        if not closed:
+            return
+
+        if self._sums is None:
+            # Doorgaan vanaf de laatst opgeslagen som zodat de reeks na een herstart doorloopt
+            self._sums = {}
+            for key in SERIES:
+                statistic_id = f"{DOMAIN}:{key}"
+                last = await get_instance(hass).async_add_executor_job(
+                    get_last_statistics, hass, 1, statistic_id, True, {"state", "sum"}
+                )
+                rows = last.get(statistic_id) or []
+                self._sums[key] = (rows[0].get("sum") or 0.0) if rows else 0.0
+                if rows:
+                    self._last_state[key] = rows[0].get("state") or 0.0
+                    start = rows[0]["start"]
+                    # Nieuwere versies geven een timestamp terug in plaats van een datetime
+                    if not isinstance(start, datetime):
+                        start = datetime.fromtimestamp(start, _UTC)
+                    self._last_written[key] = start
+
+        for key, (name, unit) in SERIES.items():
+            statistics = []
+            for hour, bucket in closed:
+                last = self._last_written.get(key)
+                if last is not None and hour < last:
+                    continue  # Ouder dan wat al in de recorder staat
+                state = bucket[key]
+                if hour == last:
+                    # Rest van een uur dat bij afsluiten deels is weggeschreven: die rij aanvullen
+                    state += self._last_state.get(key, 0.0)
+                    if statistics and statistics[-1]["start"] == hour:
+                        statistics.pop()
+                self._sums[key] += bucket[key]
+                statistics.append({"start": hour, "state": state, "sum": self._sums[key]})
+                self._last_written[key] = hour
+                self._last_state[key] = state
+            if statistics:
+                async_add_external_statistics(hass, _metadata(key, name, unit), statistics)
+
+        _LOGGER.debug(f"Wrote {len(closed)} hourly statistics bucket(s) to the recorder")
+
+
+def _metadata(key, name, unit):
+    metadata = {
+        "has_mean": False,
+        "has_sum": True,
+        "name": name,
+        "source": DOMAIN,
+        "statistic_id": f"{DOMAIN}:{key}",
+        "unit_of_measurement": unit,
+    }
+    try:
+        from homeassistant.components.recorder.models import StatisticMeanType
+    except ImportError:
+        pass  # Oudere Home Assistant versies kennen alleen has_mean
+    else:
+        metadata["mean_type"] = StatisticMeanType.NONE
+    return metadata
+
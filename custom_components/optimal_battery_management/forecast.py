@@ -0,0 +1,77 @@
+"""Incrementally maintained tariff forecast."""
+from bisect import insort
+from datetime import datetime, timedelta, timezone
+from zoneinfo import ZoneInfo
+
+MAX_HORIZON_HOURS = 48
+
+
+def parse_forecast_time(value, local_tz):
+    """Convert a forecast datetime (ISO string in UTC or datetime) to the local timezone."""
+    if isinstance(value, str):
+        if value.endswith("Z"):
+            value = value[:-1]
+        value = datetime.fromisoformat(value)
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=ZoneInfo("UTC"))
+    return value.astimezone(local_tz)
+
+
+class ForecastCache:
+    """Parsed forecast slots, updated with the delta of every new forecast attribute.
+
+    Slots are keyed by their UTC start, so the two 02:00 hours at the end of
+    summer time stay apart; the items themselves carry the local time.
+    """
+
+    def __init__(self, time_zone):
+        self._local_tz = ZoneInfo(time_zone)
+        self._known = {}  # ruwe datetime -> (prijs, starttijd in UTC)
+        self._slots = {}  # starttijd in UTC -> forecast item
+        self._order = []  # gesorteerde starttijden in UTC
+
+    def __len__(self):
+        return len(self._order)
+
+    def merge(self, forecast):
+        """Merge a forecast attribute and return the (UTC) start times of new or changed slots."""
+        changed = []
+        for item in forecast:
+            raw_time = item["datetime"]
+            price = item["electricity_price"]
+            known = self._known.get(raw_time)
+            if known is not None and known[0] == price:
+                continue  # Ongewijzigd, niet opnieuw parsen
+
+            time = known[1] if known is not None else parse_forecast_time(raw_time, timezone.utc)
+            self._known[raw_time] = (price, time)
+
+            if time not in self._slots:
+                if not self._order or time > self._order[-1]:
+                    self._order.append(time)  # Normale geval: nieuwe dag achteraan
+                else:
+                    insort(self._order, time)
+            self._slots[time] = {**item, "datetime": time.astimezone(self._local_tz)}
+            changed.append(time)
+        return changed
+
+    def prune(self, before):
+        """Drop slots that ended before `before`."""
+        drop = 0
+        while drop < len(self._order) and self._order[drop] + timedelta(hours=1) <= before:
+            del self._slots[self._order[drop]]
+            drop += 1
+        if drop:
+            del self._order[:drop]
+            # Ruwe sleutels iets langer bewaren zodat oude items in de forecast niet opnieuw geparsed worden
+            cutoff = before - timedelta(days=1)
+            self._known = {raw: known for raw, known in self._known.items() if known[1] >= cutoff}
+
+    def slots(self):
+        """Return the forecast items sorted by time."""
+        return [self._slots[time] for time in self._order]
+
+    def window(self, start, end):
+        """Return (first, last) start time of the slots whose block ends in (start, end]."""
+        inside = [time for time in self._order if start < time + timedelta(hours=1) <= end]
+        return (inside[0], inside[-1]) if inside else None
@@ -0,0 +1,191 @@
+"""Real-time modulation of the slot setpoint for a grid import limit and zero export."""
+import math
+import time
+from array import array
+
+MODE_NONE, MODE_CHARGE, MODE_DISCHARGE = 0, 1, 2
+_MODES = {"none": MODE_NONE, "charge": MODE_CHARGE, "discharge": MODE_DISCHARGE}
+
+
+class LoopStats:
+    """Running mean, standard deviation and maximum (Welford) plus a ring of recent samples.
+
+    Adding a sample writes into preallocated storage; the percentiles are only
+    sorted when they are read.
+    """
+
+    def __init__(self, recent=256):
+        self._recent = array("d", bytes(8 * recent))
+        self._capacity = recent
+        self._index = 0
+        self.count = 0
+        self.mean = 0.0
+        self._m2 = 0.0
+        self.max = 0.0
+
+    def add(self, value):
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self._m2 += delta * (value - self.mean)
+        if value > self.max:
+            self.max = value
+        self._recent[self._index] = value
+        self._index = (self._index + 1) % self._capacity
+
+    @property
+    def stdev(self):
+        return math.sqrt(self._m2 / (self.count - 1)) if self.count > 1 else 0.0
+
+    def percentile(self, fraction):
+        """Percentile of the recent samples (0 when empty)."""
+        recent = sorted(self._recent[:min(self.count, self._capacity)])
+        if not recent:
+            return 0.0
+        return recent[min(int(fraction * len(recent)), len(recent) - 1)]
+
+    def as_dict(self, scale=1000.0, digits=2):
+        """Summary in ms (scale 1000) for the sensor attributes."""
+        return {
+            "count": self.count,
+            "mean": round(self.mean * scale, digits),
+            "stdev": round(self.stdev * scale, digits),
+            "p99": round(self.percentile(0.99) * scale, digits),
+            "max": round(self.max * scale, digits),
+        }
+
+
+class GridLimitController:
+    """Modulate the battery power of the current slot on every grid power sample.
+
+    The controller sits between the charge mode sensor and the output: the slot
+    mode and rate arrive through `submit(mode, rate_kw)`, like on an
+    InverterOutputDriver, and are stored as plain numbers. Every grid sample
+    (W, positive is import) then corrects the setpoint within [0, slot rate]:
+    charging is reduced when the import exceeds `import_limit_kw`, and with
+    `zero_export` discharging is reduced when the grid exports more than
+    `export_target_kw` allows. A tick only does arithmetic on attributes and
+    calls the output when the setpoint moved by at least `deadband_kw`; the
+    deadband only holds back increases, a broken limit is always corrected.
+    """
+
+    def __init__(self, output=None, import_limit_kw=None, zero_export=False, export_target_kw=0.0,
+                 deadband_kw=0.05, gain=0.8, loop=None):
+        self._output = output
+        self._import_limit_w = import_limit_kw * 1000 if import_limit_kw is not None else math.inf
+        self._zero_export = zero_export
+        self._export_target_w = export_target_kw * 1000  # Minimale afname in W, 0 is nul-export
+        self._deadband_w = deadband_kw * 1000
+        self._gain = gain  # <1 dempt het naijlen van de omvormer na een write
+        self._loop = loop  # Event loop van de ticks, submit() kan uit een andere thread komen
+
+        # Context van het huidige blok, alleen gewijzigd door _set_slot
+        self.mode = "none"
+        self._mode = MODE_NONE
+        self._slot_w = 0.0
+        self.setpoint_w = 0.0  # Aangevraagd vermogen, positief voor laden en ontladen
+        self._grid_w = math.nan  # Laatste netmeting
+        self._last_sample = math.nan
+
+        self.adjustments = 0
+        self.limited_samples = 0
+        self.latency = LoopStats()  # Event tijdstip tot verwerking (s)
+        self.interval = LoopStats()  # Tijd tussen netmetingen (s), de spreiding is de jitter
+        self.processing = LoopStats()  # Rekentijd per tick (s)
+
+    def submit(self, mode, rate_kw):
+        """Start a new slot. Safe to call from any thread."""
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._set_slot, mode, rate_kw)
+        else:
+            self._set_slot(mode, rate_kw)
+
+    def _battery_w(self):
+        """Battery contribution to the grid power at the current setpoint (W, import positive)."""
+        if self._mode == MODE_CHARGE:
+            return self.setpoint_w
+        if self._mode == MODE_DISCHARGE:
+            return -self.setpoint_w
+        return 0.0
+
+    def _set_slot(self, mode, rate_kw):
+        household_w = self._grid_w - self._battery_w()  # NaN zolang er geen meting is
+        self.mode = mode
+        self._mode = _MODES.get(mode, MODE_NONE)
+        self._slot_w = rate_kw * 1000 if self._mode != MODE_NONE else 0.0
+        self.setpoint_w = self._slot_w
+        if household_w == household_w:
+            # Direct begrenzen met de laatste meting, alsof het blok al op vol vermogen liep
+            self.setpoint_w = self._target(household_w + self._battery_w())
+        self._submit()
+
+    def _target(self, grid_w):
+        """Setpoint for the measured grid power, clamped to the slot rate."""
+        if self._mode == MODE_CHARGE:
+            target = self.setpoint_w + self._gain * (self._import_limit_w - grid_w)
+        elif self._mode == MODE_DISCHARGE and self._zero_export:
+            target = self.setpoint_w + self._gain * (grid_w - self._export_target_w)
+        else:
+            return self._slot_w
+        if target >= self._slot_w:
+            return self._slot_w
+        self.limited_samples += 1
+        return target if target > 0.0 else 0.0
+
+    def _over_limit(self, grid_w):
+        """True when the grid power breaks the import limit or the export target."""
+        if self._mode == MODE_CHARGE:
+            return grid_w > self._import_limit_w
+        if self._mode == MODE_DISCHARGE and self._zero_export:
+            return grid_w < self._export_target_w
+        return False
+
+    def update(self, timestamp, grid_w, received=None):
+        """Handle a grid power sample taken at `timestamp` (epoch s), `received` is the handling time."""
+        started = time.perf_counter()
+        if received is not None:
+            self.latency.add(received - timestamp)
+        if self._last_sample == self._last_sample and timestamp > self._last_sample:
+            self.interval.add(timestamp - self._last_sample)
+        self._last_sample = timestamp
+        self._grid_w = grid_w
+
+        target = self._target(grid_w)
+        if target != self.setpoint_w and (
+            (target < self.setpoint_w and self._over_limit(grid_w))  # Een overschreden limiet altijd corrigeren
+            or abs(target - self.setpoint_w) >= self._deadband_w or target == 0.0 or target == self._slot_w
+        ):
+            self.setpoint_w = target
+            self.adjustments += 1
+            self._submit()
+        self.processing.add(time.perf_counter() - started)
+
+    def _submit(self):
+        if self._output is not None:
+            self._output.submit(self.mode, self.setpoint_w / 1000)
+
+    @property
+    def limiting(self):
+        """True while the setpoint is below the slot rate."""
+        return self._mode != MODE_NONE and self.setpoint_w < self._slot_w
+
+    def as_dict(self):
+        """Slot and configuration, only changes with the slot."""
+        return {
+            "mode": self.mode,
+            "slot_rate_kw": round(self._slot_w / 1000, 3),
+            "import_limit_kw": round(self._import_limit_w / 1000, 2) if self._import_limit_w != math.inf else None,
+            "zero_export": self._zero_export,
+        }
+
+    def stats(self):
+        """Counters and loop timing, these change on every sample."""
+        return {
+            "grid_power_kw": round(self._grid_w / 1000, 3) if self._grid_w == self._grid_w else None,
+            "limiting": self.limiting,
+            "adjustments": self.adjustments,
+            "limited_samples": self.limited_samples,
+            "latency_ms": self.latency.as_dict(),
+            "interval_ms": self.interval.as_dict(),
+            "processing_us": self.processing.as_dict(scale=1e6, digits=1),
+        }
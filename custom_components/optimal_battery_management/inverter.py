@@ -0,0 +1,290 @@
+"""Direct inverter control over Modbus TCP."""
+import asyncio
+import logging
+import struct
+
+_LOGGER = logging.getLogger(__name__)
+
+FUNC_READ_HOLDING = 0x03
+FUNC_WRITE_MULTIPLE = 0x10
+
+DEFAULT_MODE_VALUES = {"none": 0, "charge": 1, "discharge": 2}
+
+
+class ModbusError(Exception):
+    """Raised when the inverter answers with a Modbus exception or a malformed frame."""
+
+
+def _runs(registers, max_count):
+    """Group {address: value} into [(start, [values])] of consecutive addresses."""
+    runs = []
+    for address in sorted(registers):
+        if runs and address == runs[-1][0] + len(runs[-1][1]) and len(runs[-1][1]) < max_count:
+            runs[-1][1].append(registers[address])
+        else:
+            runs.append((address, [registers[address]]))
+    return runs
+
+
+class ModbusTcpClient:
+    """Minimal persistent Modbus TCP client for holding registers."""
+
+    def __init__(self, host, port=502, timeout=3.0):
+        self._host = host
+        self._port = port
+        self._timeout = timeout
+        self._reader = None
+        self._writer = None
+        self._lock = asyncio.Lock()
+        self._transaction_id = 0
+        self.users = 0  # Aantal drivers dat deze verbinding deelt
+
+    @property
+    def connected(self):
+        return self._writer is not None and not self._writer.is_closing()
+
+    async def _ensure_connected(self):
+        if self.connected:
+            return
+        _LOGGER.debug(f"Opening Modbus TCP connection to {self._host}:{self._port}")
+        self._reader, self._writer = await asyncio.wait_for(
+            asyncio.open_connection(self._host, self._port), self._timeout
+        )
+
+    async def close(self):
+        """Close the connection, it is reopened on the next request."""
+        if self._writer is not None:
+            self._writer.close()
+            try:
+                await self._writer.wait_closed()
+            except OSError:
+                pass
+        self._reader = self._writer = None
+
+    def _frame(self, unit_id, pdu):
+        self._transaction_id = (self._transaction_id + 1) & 0xFFFF
+        header = struct.pack(">HHHB", self._transaction_id, 0, len(pdu) + 1, unit_id)
+        return self._transaction_id, header + pdu
+
+    async def _read_response(self):
+        header = await asyncio.wait_for(self._reader.readexactly(7), self._timeout)
+        transaction_id, _protocol, length, _unit = struct.unpack(">HHHB", header)
+        pdu = await asyncio.wait_for(self._reader.readexactly(length - 1), self._timeout)
+        if not pdu or (pdu[0] & 0x80 and len(pdu) < 2):
+            raise ModbusError(f"Malformed response PDU {pdu.hex()}")
+        if pdu[0] & 0x80:
+            raise ModbusError(f"Modbus exception {pdu[1]} for function {pdu[0] & 0x7F}")
+        return transaction_id, pdu
+
+    async def _transact(self, unit_id, pdus):
+        """Send all request PDUs in one go (pipelined) and return the response PDUs in order."""
+        async with self._lock:
+            try:
+                await self._ensure_connected()
+                frames = [self._frame(unit_id, pdu) for pdu in pdus]
+                self._writer.write(b"".join(frame for _, frame in frames))
+                await self._writer.drain()
+
+                responses = {}
+                for _ in frames:
+                    transaction_id, pdu = await self._read_response()
+                    responses[transaction_id] = pdu
+            except (OSError, asyncio.IncompleteReadError, asyncio.TimeoutError, ModbusError):
+                # Verbinding in onbekende toestand, bij volgende request opnieuw openen
+                await self.close()
+                raise
+
+        try:
+            return [responses[transaction_id] for transaction_id, _ in frames]
+        except KeyError as err:
+            raise ModbusError(f"Missing response for transaction {err}") from err
+
+    async def write_registers(self, unit_id, registers):
+        """Write {address: value} in as few FC16 requests as possible."""
+        pdus = [
+            struct.pack(f">BHHB{len(values)}H", FUNC_WRITE_MULTIPLE, start, len(values), len(values) * 2, *values)
+            for start, values in _runs(registers, 123)
+        ]
+        for pdu in await self._transact(unit_id, pdus):
+            if pdu[0] != FUNC_WRITE_MULTIPLE:
+                raise ModbusError(f"Unexpected function {pdu[0]} in write response")
+        return len(pdus)
+
+    async def read_registers(self, unit_id, address, count):
+        """Read `count` holding registers starting at `address`."""
+        pdu = struct.pack(">BHH", FUNC_READ_HOLDING, address, count)
+        (response,) = await self._transact(unit_id, [pdu])
+        if response[0] != FUNC_READ_HOLDING or response[1] != count * 2:
+            raise ModbusError("Malformed read response")
+        return list(struct.unpack(f">{count}H", response[2:2 + count * 2]))
+
+    async def read_register_map(self, unit_id, addresses):
+        """Read the given holding registers as {address: value}, one FC3 request per contiguous run."""
+        runs = _runs(dict.fromkeys(addresses, 0), 125)
+        pdus = [struct.pack(">BHH", FUNC_READ_HOLDING, start, len(values)) for start, values in runs]
+        result = {}
+        for (start, values), response in zip(runs, await self._transact(unit_id, pdus)):
+            count = len(values)
+            if response[0] != FUNC_READ_HOLDING or response[1] != count * 2:
+                raise ModbusError("Malformed read response")
+            for offset, value in enumerate(struct.unpack(f">{count}H", response[2:2 + count * 2])):
+                result[start + offset] = value
+        return result
+
+
+_POOL = {}
+
+
+def acquire_client(host, port, timeout=3.0):
+    """Return the shared client for host:port, so several drivers use one socket."""
+    client = _POOL.get((host, port))
+    if client is None:
+        client = _POOL[(host, port)] = ModbusTcpClient(host, port, timeout)
+    client.users += 1
+    return client
+
+
+async def release_client(client):
+    """Drop a reference to a pooled client and close it when unused."""
+    client.users -= 1
+    if client.users <= 0:
+        _POOL.pop((client._host, client._port), None)
+        await client.close()
+
+
+def _to_register(value):
+    """Encode a signed integer as a 16 bit two's complement register value."""
+    value = max(-0x8000, min(0x7FFF, int(round(value))))
+    return value & 0xFFFF
+
+
+class InverterOutputDriver:
+    """Turn charge mode transitions and slot rates into inverter register writes."""
+
+    def __init__(self, hass, config):
+        """Initialize the driver from the `inverter_output` configuration."""
+        self.hass = hass
+        self._host = config.get("host")
+        self._port = config.get("port", 502)
+        self._unit_id = config.get("unit_id", 1)
+        self._mode_register = config.get("mode_register")
+        self._power_register = config.get("power_register")
+        self._mode_values = {**DEFAULT_MODE_VALUES, **config.get("mode_values", {})}
+        self._power_scale = config.get("power_scale", 1.0)  # Watt per registereenheid
+        self._min_write_interval = config.get("min_write_interval", 2.0)  # Seconden
+        self._verify = config.get("verify", True)
+        self._retry_delay = config.get("retry_delay", 5.0)
+        self._timeout = config.get("timeout", 3.0)
+
+        if not self._host or self._mode_register is None:
+            raise ValueError("inverter_output requires at least 'host' and 'mode_register'")
+        if not isinstance(self._power_scale, (int, float)) or self._power_scale <= 0:
+            raise ValueError(f"inverter_output power_scale must be a positive number, got {self._power_scale!r}")
+
+        self._client = None
+        self._task = None
+        self._wakeup = None
+        self._pending = None  # Laatst aangevraagde (mode, rate_kw)
+        self._written = None  # Laatst bevestigd geschreven (mode, rate_kw)
+        self._last_write = None
+        self.write_count = 0
+        self.verify_failures = 0
+
+    async def async_start(self):
+        """Open the pooled connection and start the writer task."""
+        self._client = acquire_client(self._host, self._port, self._timeout)
+        self._wakeup = asyncio.Event()
+        self._task = self.hass.loop.create_task(self._run())
+        if self._pending is not None:
+            self._wakeup.set()
+
+    async def async_stop(self, *_):
+        """Stop the writer task and release the connection."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._client is not None:
+            await release_client(self._client)
+            self._client = None
+
+    def submit(self, mode, rate_kw):
+        """Request a new mode and power setpoint. Safe to call from any thread."""
+        self.hass.loop.call_soon_threadsafe(self._submit, mode, rate_kw)
+
+    def _submit(self, mode, rate_kw):
+        # Nieuwere aanvragen overschrijven oudere die nog niet geschreven zijn
+        self._pending = (mode, rate_kw)
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def _encode(self, mode, rate_kw):
+        if mode not in self._mode_values:
+            raise ValueError(f"No register value configured for mode '{mode}'")
+        registers = {self._mode_register: self._mode_values[mode] & 0xFFFF}
+        if self._power_register is not None:
+            power_w = rate_kw * 1000 if mode != "none" else 0
+            registers[self._power_register] = _to_register(power_w / self._power_scale)
+        return registers
+
+    async def _verify_registers(self, registers):
+        # Per aaneengesloten reeks teruglezen, registers ver uit elkaar passen niet in één FC3 request
+        values = await self._client.read_register_map(self._unit_id, registers)
+        return all(values[address] == value for address, value in registers.items())
+
+    async def _run(self):
+        loop = self.hass.loop
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+
+            # Rate limiting: wacht tot de minimale interval verstreken is, tussentijdse aanvragen worden samengevoegd
+            if self._last_write is not None:
+                delay = self._min_write_interval - (loop.time() - self._last_write)
+                if delay > 0:
+                    await asyncio.sleep(delay)
+
+            command = self._pending
+            if command is None or command == self._written:
+                continue
+
+            try:
+                registers = self._encode(*command)
+            except (TypeError, ValueError) as err:
+                _LOGGER.error(f"Cannot write inverter command {command}: {err}")
+                self._pending = self._written
+                continue
+
+            try:
+                requests = await self._client.write_registers(self._unit_id, registers)
+                self._last_write = loop.time()
+                self.write_count += 1
+                if self._verify and not await self._verify_registers(registers):
+                    self.verify_failures += 1
+                    raise ModbusError(f"Read-back of registers {registers} does not match")
+            except (OSError, asyncio.IncompleteReadError, asyncio.TimeoutError, ModbusError) as err:
+                _LOGGER.warning(
+                    f"Writing inverter command {command} to {self._host}:{self._port} failed: {err}. "
+                    f"Retrying in {self._retry_delay}s"
+                )
+                self._last_write = loop.time()
+                loop.call_later(self._retry_delay, self._wakeup.set)
+                continue
+            except Exception:  # Onverwachte fout mag de writer niet stilletjes stoppen
+                _LOGGER.exception(
+                    f"Unexpected error writing inverter command {command} to {self._host}:{self._port}. "
+                    f"Retrying in {self._retry_delay}s"
+                )
+                await self._client.close()  # Verbinding in onbekende toestand
+                self._last_write = loop.time()
+                loop.call_later(self._retry_delay, self._wakeup.set)
+                continue
+
+            self._written = command
+            _LOGGER.info(
+                f"Inverter set to {command[0]} at {command[1]:.2f} kW "
+                f"({len(registers)} registers in {requests} request(s))"
+            )
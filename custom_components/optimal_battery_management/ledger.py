@@ -0,0 +1,138 @@
+"""FIFO cost basis of the energy stored in the battery."""
+import threading
+from collections import deque
+
+
+class CostBasisLedger:
+    """Charged lots of [kWh, €/kWh], consumed oldest first on discharge.
+
+    At most `max_lots` lots are kept. Beyond that the two newest lots are
+    merged, so the lots that are discharged next keep their exact cost.
+    """
+
+    def __init__(self, max_lots=48, min_energy=0.0005):
+        self._max_lots = max(max_lots, 2)
+        self._min_energy = min_energy  # Kleinere restjes (kWh) tellen niet als lot
+        self._lock = threading.Lock()  # Schrijven vanuit de laadprijssensor, lezen vanuit de planning
+        self._lots = deque()
+        self._energy = 0.0
+        self._cost = 0.0
+        self._discharging = False
+        self.realized_profit = 0.0  # EUR, opbrengst min kostprijs van alle ontladen energie
+        self.cycle_profit = 0.0  # EUR, lopende ontlaadcyclus
+        self.last_cycle_profit = None  # EUR, vorige afgesloten cyclus
+        self.lost_energy = 0.0  # kWh, verlies afgeleid uit de SoC
+
+    @property
+    def energy(self):
+        return self._energy
+
+    @property
+    def lot_count(self):
+        return len(self._lots)
+
+    @property
+    def marginal_cost(self):
+        """Cost (€/kWh) of the next kWh that will be discharged."""
+        with self._lock:
+            return self._lots[0][1] if self._lots else 0.0
+
+    @property
+    def average_cost(self):
+        """Cost (€/kWh) of all stored energy."""
+        with self._lock:
+            return self._cost / self._energy if self._energy > self._min_energy else 0.0
+
+    def charge(self, energy_kwh, price):
+        """Add a charged lot, merged with the newest lot when the price is the same."""
+        if energy_kwh <= 0:
+            return
+        with self._lock:
+            if self._discharging:
+                self._close_cycle()
+            if self._lots and abs(self._lots[-1][1] - price) < 1e-9:
+                self._lots[-1][0] += energy_kwh
+            else:
+                self._lots.append([energy_kwh, price])
+                if len(self._lots) > self._max_lots:
+                    self._coalesce()
+            self._energy += energy_kwh
+            self._cost += energy_kwh * price
+
+    def _coalesce(self):
+        # Nieuwste lots samenvoegen, die worden pas als laatste ontladen
+        energy_b, price_b = self._lots.pop()
+        energy_a, price_a = self._lots.pop()
+        energy = energy_a + energy_b
+        self._lots.append([energy, (energy_a * price_a + energy_b * price_b) / energy])
+
+    def _take(self, energy_kwh):
+        """Remove `energy_kwh` oldest first and return its cost (EUR)."""
+        cost = 0.0
+        remaining = energy_kwh
+        price = self._lots[0][1] if self._lots else 0.0
+        while remaining > 0 and self._lots:
+            lot = self._lots[0]
+            price = lot[1]
+            used = min(lot[0], remaining)
+            lot[0] -= used
+            remaining -= used
+            cost += used * price
+            if lot[0] <= self._min_energy:
+                self._lots.popleft()  # Restje afboeken, anders blijven er lots van niets over
+                self._energy -= lot[0]
+                self._cost -= lot[0] * price
+        cost += remaining * price  # Meer ontladen dan bekend, tegen de laatste kostprijs
+        if self._lots:
+            self._energy = max(self._energy - energy_kwh, 0.0)
+            self._cost = max(self._cost - cost, 0.0)
+        else:
+            self._energy = self._cost = 0.0
+        return cost
+
+    def discharge(self, energy_kwh, price):
+        """Consume stored energy FIFO and book the profit at the discharge `price`."""
+        if energy_kwh <= 0:
+            return 0.0
+        with self._lock:
+            self._discharging = True
+            profit = energy_kwh * price - self._take(energy_kwh)
+            self.realized_profit += profit
+            self.cycle_profit += profit
+        return profit
+
+    def _close_cycle(self):
+        self.last_cycle_profit = self.cycle_profit
+        self.cycle_profit = 0.0
+        self._discharging = False
+
+    def sync(self, energy_kwh, price, tolerance=0.05):
+        """Align the ledger with the energy derived from the SoC.
+
+        Extra energy (e.g. after a restart) is added as a lot at `price`,
+        missing energy is treated as loss of the oldest lots.
+        """
+        with self._lock:
+            difference = energy_kwh - self._energy
+            if difference > tolerance:
+                self._lots.append([difference, price])
+                if len(self._lots) > self._max_lots:
+                    self._coalesce()
+                self._energy += difference
+                self._cost += difference * price
+            elif difference < -tolerance:
+                loss = self._take(-difference)  # Kostprijs van het verlies drukt de winst
+                self.lost_energy += -difference
+                self.realized_profit -= loss
+                self.cycle_profit -= loss
+
+    def as_dict(self):
+        with self._lock:
+            return {
+                "stored_energy": round(self._energy, 3),
+                "marginal_cost": round(self._lots[0][1], 4) if self._lots else 0.0,
+                "lots": len(self._lots),
+                "realized_profit": round(self.realized_profit, 4),
+                "cycle_profit": round(self.cycle_profit, 4),
+                "last_cycle_profit": round(self.last_cycle_profit, 4) if self.last_cycle_profit is not None else None,
+            }
@@ -0,0 +1,193 @@
+"""Live intraday/imbalance prices from a push feed."""
+import asyncio
+import json
+import logging
+from datetime import datetime, timezone
+from urllib.parse import urlparse
+
+_LOGGER = logging.getLogger(__name__)
+
+SLOT = 3600  # Seconden per blok van de day-ahead planning
+
+
+def parse_price(line):
+    """Return (epoch seconds, €/kWh) from a JSON line like {"time": "...Z", "price": 0.43}."""
+    message = json.loads(line)
+    moment = message.get("time", message.get("timestamp"))
+    if isinstance(moment, str):
+        moment = datetime.fromisoformat(moment.replace("Z", "+00:00"))
+        if moment.tzinfo is None:
+            moment = moment.replace(tzinfo=timezone.utc)
+        moment = moment.timestamp()
+    return float(moment), float(message["price"])
+
+
+class LivePriceOverlay:
+    """Latest, lowest and highest live price per hourly slot, for at most `max_slots` slots."""
+
+    def __init__(self, max_slots=48):
+        self._max_slots = max_slots
+        self._slots = {}  # UTC blokstart (epoch) -> [laatste, laagste, hoogste, aantal]
+        self.latest = None  # (epoch, €/kWh) van de nieuwste prijs
+        self.stale = 0  # Prijzen ouder dan de nieuwste, genegeerd
+
+    def add(self, timestamp, price):
+        """Add a live price, return False when it is older than the latest one."""
+        if self.latest is not None and timestamp < self.latest[0]:
+            self.stale += 1
+            return False
+        self.latest = (timestamp, price)
+        start = timestamp - timestamp % SLOT
+        slot = self._slots.get(start)
+        if slot is None:
+            self._slots[start] = [price, price, price, 1]
+            if len(self._slots) > self._max_slots:
+                del self._slots[min(self._slots)]  # Oudste blok vergeten
+        else:
+            slot[0] = price
+            slot[1] = min(slot[1], price)
+            slot[2] = max(slot[2], price)
+            slot[3] += 1
+        return True
+
+    def slot(self, start):
+        """{"latest", "min", "max", "count"} for the slot starting at `start` (epoch), or None."""
+        slot = self._slots.get(start)
+        if slot is None:
+            return None
+        return {"latest": slot[0], "min": slot[1], "max": slot[2], "count": slot[3]}
+
+
+class PriceStreamClient:
+    """Read live prices from tcp://host:port (one JSON object per line) or a ws:// / wss:// feed.
+
+    The reader puts parsed prices in a bounded queue and waits when it is
+    full, so a slow consumer pushes back on the socket instead of growing a
+    buffer. The consumer takes everything queued at once, adds it to the
+    overlay and calls `on_update(timestamp, price)` once with the newest price.
+    """
+
+    def __init__(self, url, on_update, overlay=None, queue_size=64, retry_delay=5.0, max_line=4096, session=None):
+        self._url = url
+        self._on_update = on_update
+        self.overlay = overlay if overlay is not None else LivePriceOverlay()
+        self._queue_size = queue_size
+        self._retry_delay = retry_delay
+        self._max_line = max_line  # Langere regels zijn een protocolfout
+        self._session = session  # aiohttp ClientSession voor websockets
+        self._queue = None
+        self._tasks = []
+        self.received = 0
+        self.invalid = 0
+        self.coalesced = 0  # Prijzen die samen met een nieuwere verwerkt zijn
+        self.max_queue_depth = 0
+        self.reconnects = 0
+        self.connected = False
+
+        scheme = urlparse(url).scheme
+        if scheme not in ("tcp", "ws", "wss"):
+            raise ValueError(f"Unsupported live price url '{url}', use tcp://, ws:// or wss://")
+
+    async def async_start(self):
+        """Start the reader and consumer tasks."""
+        loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue(self._queue_size)
+        self._tasks = [loop.create_task(self._run()), loop.create_task(self._consume())]
+
+    async def async_stop(self, *_):
+        """Stop both tasks, queued prices are dropped."""
+        for task in self._tasks:
+            task.cancel()
+        for task in self._tasks:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._tasks = []
+
+    async def _put(self, line):
+        line = line.strip()
+        if not line:
+            return
+        try:
+            timestamp, price = parse_price(line)
+        except (ValueError, KeyError, TypeError, AttributeError) as err:
+            self.invalid += 1
+            _LOGGER.debug(f"Ignoring live price message {line[:80]!r}: {err}")
+            return
+        self.received += 1
+        await self._queue.put((timestamp, price))  # Wacht als de wachtrij vol is
+        self.max_queue_depth = max(self.max_queue_depth, self._queue.qsize())
+
+    async def _read_tcp(self, host, port):
+        reader, writer = await asyncio.open_connection(host, port, limit=self._max_line)
+        self.connected = True
+        _LOGGER.info(f"Connected to live price stream {host}:{port}")
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    raise ConnectionError("live price stream closed")
+                await self._put(line.decode("utf-8", "replace"))
+        finally:
+            writer.close()
+
+    async def _read_websocket(self):
+        import aiohttp  # Alleen nodig voor websockets, Home Assistant levert het mee
+
+        session = self._session or aiohttp.ClientSession()
+        try:
+            async with session.ws_connect(self._url, heartbeat=30, max_msg_size=self._max_line * 64) as websocket:
+                self.connected = True
+                _LOGGER.info(f"Connected to live price websocket {self._url}")
+                async for message in websocket:
+                    if message.type != aiohttp.WSMsgType.TEXT:
+                        break
+                    for line in message.data.splitlines():
+                        await self._put(line)
+            raise ConnectionError("live price websocket closed")
+        finally:
+            if self._session is None:
+                await session.close()
+
+    async def _run(self):
+        address = urlparse(self._url)
+        while True:
+            try:
+                if address.scheme == "tcp":
+                    await self._read_tcp(address.hostname, address.port)
+                else:
+                    await self._read_websocket()
+            except asyncio.CancelledError:
+                raise
+            except Exception as err:  # aiohttp.ClientError, OSError, ValueError (te lange regel), ...
+                _LOGGER.warning(f"Live price stream {self._url} failed: {err}. Reconnecting in {self._retry_delay}s")
+            self.connected = False
+            self.reconnects += 1
+            await asyncio.sleep(self._retry_delay)
+
+    async def _consume(self):
+        while True:
+            timestamp, price = await self._queue.get()
+            accepted = self.overlay.add(timestamp, price)
+            while not self._queue.empty():
+                timestamp, price = self._queue.get_nowait()
+                accepted = self.overlay.add(timestamp, price) or accepted
+                self.coalesced += 1
+            if accepted:
+                try:
+                    self._on_update(*self.overlay.latest)
+                except Exception:  # Een fout in de callback mag de stream niet stoppen
+                    _LOGGER.exception("Error handling live price")
+
+    def as_dict(self):
+        return {
+            "connected": self.connected,
+            "received": self.received,
+            "invalid": self.invalid,
+            "stale": self.overlay.stale,
+            "coalesced": self.coalesced,
+            "queue_depth": self._queue.qsize() if self._queue is not None else 0,
+            "max_queue_depth": self.max_queue_depth,
+            "reconnects": self.reconnects,
+        }
@@ -0,0 +1,87 @@
+"""Local Modbus TCP stand-in for testing the inverter output without hardware.
+
+Run with: python modbus_sim.py --port 5020
+"""
+import argparse
+import asyncio
+import logging
+import struct
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class ModbusTcpSimulator:
+    """Tiny Modbus TCP server with one bank of holding registers."""
+
+    def __init__(self, host="127.0.0.1", port=5020):
+        self.host = host
+        self.port = port
+        self.registers = [0] * 0x10000
+        self.writes = []  # (address, values) in volgorde van ontvangst
+        self._server = None
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle_client, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        _LOGGER.info(f"Modbus simulator listening on {self.host}:{self.port}")
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+
+    def _handle_pdu(self, pdu):
+        function = pdu[0]
+        if function == 0x03:
+            address, count = struct.unpack(">HH", pdu[1:5])
+            if not 1 <= count <= 125 or address + count > 0x10000:
+                return bytes([function | 0x80, 0x02])
+            values = self.registers[address:address + count]
+            return struct.pack(f">BB{count}H", function, count * 2, *values)
+        if function == 0x06:
+            address, value = struct.unpack(">HH", pdu[1:5])
+            self.registers[address] = value
+            self.writes.append((address, [value]))
+            return pdu[:5]
+        if function == 0x10:
+            address, count, _byte_count = struct.unpack(">HHB", pdu[1:6])
+            if address + count > 0x10000:
+                return bytes([function | 0x80, 0x02])
+            values = list(struct.unpack(f">{count}H", pdu[6:6 + count * 2]))
+            self.registers[address:address + count] = values
+            self.writes.append((address, values))
+            _LOGGER.debug(f"Registers {address}..{address + count - 1} set to {values}")
+            return struct.pack(">BHH", function, address, count)
+        return bytes([function | 0x80, 0x01])
+
+    async def _handle_client(self, reader, writer):
+        try:
+            while True:
+                header = await reader.readexactly(7)
+                transaction_id, protocol, length, unit_id = struct.unpack(">HHHB", header)
+                pdu = await reader.readexactly(length - 1)
+                response = self._handle_pdu(pdu)
+                writer.write(struct.pack(">HHHB", transaction_id, protocol, len(response) + 1, unit_id) + response)
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+
+async def _serve(host, port):
+    simulator = ModbusTcpSimulator(host, port)
+    await simulator.start()
+    await asyncio.Event().wait()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local Modbus TCP inverter stand-in")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5020)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.DEBUG)
+    try:
+        asyncio.run(_serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
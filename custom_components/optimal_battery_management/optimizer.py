@@ -0,0 +1,412 @@
+"""Charge and discharge scheduling, without Home Assistant dependencies."""
+import logging
+from datetime import datetime, timedelta, timezone
+from zoneinfo import ZoneInfo
+
+from .clock import SYSTEM_CLOCK
+
+_LOGGER = logging.getLogger(__name__)
+
+
+def _charge_price(item, estimate_margin):
+    """Price (€/kWh) used to pick charge slots, estimated prices count as more expensive."""
+    price = item["electricity_price"] / 1e7
+    return price + estimate_margin if item.get("estimated") else price
+
+
+def _discharge_price(item, estimate_margin):
+    """Price (€/kWh) used to pick discharge slots, estimated prices count as cheaper."""
+    price = item["electricity_price"] / 1e7
+    return price - estimate_margin if item.get("estimated") else price
+
+
+def _slot_start(item):
+    """UTC start of a forecast item, string times are UTC."""
+    forecast_time = item["datetime"]
+    if isinstance(forecast_time, str):
+        forecast_time = datetime.fromisoformat(forecast_time).replace(tzinfo=ZoneInfo("UTC"))
+    return forecast_time.astimezone(timezone.utc)
+
+
+def _future_forecast(forecast, now_utc, hours_ahead):
+    """Forecast items (sorted) whose slot ends after `now_utc` and at the latest at `hours_ahead`."""
+    future_forecast = []
+    for item in forecast:
+        forecast_time = item["datetime"]
+        block_time = _slot_start(item) + timedelta(hours=1)
+
+        if now_utc < block_time <= hours_ahead:     # niet te ver vooruit anders nu als tijden voor morgen (4 tijden eerste 10 uur
+            future_forecast.append(item)
+            _LOGGER.debug("Forecast_time: %s till block_time %s added", forecast_time, block_time )
+        else:
+            _LOGGER.debug("NO Forecast_time for: %s till block_time %s", forecast_time, block_time)
+            if block_time > hours_ahead:
+                break  # Alle volgende blokken liggen buiten de horizon, dus stoppen
+    return future_forecast
+
+
+def calculate_optimal_schedule(forecast, current_capacity, max_capacity, charge_rate, discharge_rate, depreciation_per_kwh, min_profit, time_zone, horizon_hours=11, reserve_kwh=0.0, avg_charge_price=0.0, now=None, power_curve=None, marginal_cost=None, clock=SYSTEM_CLOCK, estimate_margin=0.0):
+    """Calculate optimal charge and discharge schedule based on forecast.
+
+    avg_charge_price is the cost (€/kWh) of the energy in the battery; when
+    `marginal_cost` (cost of the next kWh out, FIFO) is known it is used
+    instead. `now` defaults to the time of `clock` in `time_zone`. With a
+    PowerCurve the slot rates are replaced by the energy the battery can
+    actually take or give. Forecast items flagged "estimated" are penalised
+    by `estimate_margin` (€/kWh) when choosing and checking slots.
+    """
+    _LOGGER.info("Starting calculation of optimal schedule.")
+
+    if now is None:
+        now = clock.now(ZoneInfo(time_zone))  # Gebruik de doorgegeven tijdzone
+    else:
+        now = now.astimezone(ZoneInfo(time_zone))
+
+    # Log current time for debugging
+    _LOGGER.info(f"Home Assistant timezone: {time_zone}")
+    #_LOGGER.debug(f"Current local time: {datetime.now(ZoneInfo(time_zone))}")
+    _LOGGER.info(f"Current now time: {now}")
+    
+    # Calculate required charge capacity
+    remaining_charge_capacity = max_capacity - current_capacity
+    available_discharge_capacity = current_capacity
+
+    # Blokgrenzen in UTC rekenen, lokale tijd telt bij zomer-/wintertijd een uur te veel of te weinig
+    now_utc = now.astimezone(timezone.utc)
+
+    # Filter future forecast data
+    hours_ahead = now_utc + timedelta(hours=horizon_hours)  # Define the cutoff time
+    future_forecast = _future_forecast(forecast, now_utc, hours_ahead)
+
+    if not future_forecast:
+        _LOGGER.warning("No valid forecast data available for the future!")
+        return []
+
+    # Sort by cheapest and most expensive periods
+    cheapest_periods = sorted(future_forecast, key=lambda x: _charge_price(x, estimate_margin))[:3]
+    most_expensive_periods = sorted(future_forecast, key=lambda x: -_discharge_price(x, estimate_margin))[:3]
+    most_expensive_period = sorted(future_forecast, key=lambda x: -_discharge_price(x, estimate_margin))[:1]
+    average_peak_price = sum(_discharge_price(item, estimate_margin) for item in most_expensive_periods) / len(most_expensive_periods)
+
+    _LOGGER.debug("Cheapest periods: %s", cheapest_periods)
+    _LOGGER.debug("Most expensive periods: %s", most_expensive_periods)
+    _LOGGER.debug("Most expensive period: %s", most_expensive_period)
+    _LOGGER.debug("AVG expensive periods: %.3f €/kWh", average_peak_price)
+
+    # Calculate charge schedule
+    charge_schedule = []
+    
+    #hier zou je later de actuele waarde kunnen vullen soc*totaal
+    total_charge_capacity = 0
+    
+    seen_charge_times = set()  # bewaakt unieke (tijd, "charge") entries
+
+    # Charge schedule zonder beperkingen
+    for item in cheapest_periods:
+        if isinstance(item["datetime"], str):
+            time = datetime.fromisoformat(item["datetime"])
+        else:
+            time = item["datetime"]
+
+        price = item["electricity_price"] / 1e7
+
+        key = (time, "charge")
+        if key in seen_charge_times:
+            continue
+        seen_charge_times.add(key)
+
+        charge_schedule.append({
+            "time": time,
+            "price": price,
+            "action": "charge",
+            "rate": charge_rate
+        })
+
+    
+        _LOGGER.debug(
+            "Adding charge period at %s: Price %.2f €/kWh.",
+            time, price
+        )
+
+
+    # Filter forecastdata van nu tot aan de duurste piekperiode
+    pre_peak_forecast = []
+
+    # Haal de tijd van het duurste blok op
+    most_expensive_time = most_expensive_period[0]["datetime"]
+    if isinstance(most_expensive_time, str):
+        most_expensive_time = datetime.fromisoformat(most_expensive_time).replace(tzinfo=ZoneInfo("UTC"))
+
+    for item in forecast:
+        forecast_time = item["datetime"]
+        if isinstance(forecast_time, str):
+            forecast_time = datetime.fromisoformat(forecast_time).replace(tzinfo=ZoneInfo("UTC"))
+
+        block_time = forecast_time.astimezone(timezone.utc) + timedelta(hours=1)
+
+        # Alleen blokken opnemen die eindigen vóór de piek
+        if now_utc < block_time <= most_expensive_time:
+            pre_peak_forecast.append(item)
+            _LOGGER.debug("PRE-PEAK Forecast_time: %s till block_time %s added", forecast_time, block_time)
+        else:
+            _LOGGER.debug("NO PRE-PEAK Forecast_time for: %s till block_time %s", forecast_time, block_time)
+            if block_time > most_expensive_time:
+                break  # Alle volgende blokken liggen ook na de piek, dus stoppen
+
+    if not pre_peak_forecast:
+        _LOGGER.warning("No valid pre-peak forecast data available!")
+    else:
+        _LOGGER.debug("pre_peak_forecast: %s", pre_peak_forecast)
+        cheapest_pre_peak_periods = sorted(pre_peak_forecast, key=lambda x: _charge_price(x, estimate_margin))[:3]
+        _LOGGER.debug("Pre_peak_periods: %s", cheapest_pre_peak_periods)
+
+        # Extra pre-peak charge momenten (optioneel toevoegen als ze voldoen aan de prijsvoorwaarde)
+
+        for item in cheapest_pre_peak_periods:
+            if isinstance(item["datetime"], str):
+                time = datetime.fromisoformat(item["datetime"])
+            else:
+                time = item["datetime"]
+
+            price = item["electricity_price"] / 1e7  # Omzetten naar €/kWh
+
+            # Voorwaarde: alleen toevoegen als prijs lager is dan piek - marge
+            if _charge_price(item, estimate_margin) < (average_peak_price - (depreciation_per_kwh + min_profit)):
+                key = (time, "charge")
+                if key in seen_charge_times:
+                    continue
+                seen_charge_times.add(key)
+
+                charge_schedule.append({
+                    "time": time,
+                    "price": price,
+                    "action": "charge",
+                    "rate": charge_rate
+                })
+
+                _LOGGER.debug(
+                    "Adding PRE-PEAK charge period at %s: Price %.3f €/kWh (threshold: %.3f)",
+                    time, price, average_peak_price - (depreciation_per_kwh + min_profit)
+                )
+            else:
+                _LOGGER.debug(
+                    "Skipping PRE-PEAK charge period at %s: Price %.3f €/kWh is above threshold %.3f",
+                    time, price, average_peak_price - (depreciation_per_kwh + min_profit)
+                )
+
+    # Calculate discharge schedule
+    discharge_schedule = []
+    total_discharge_capacity = 0
+
+    # Bepaal de drempelwaarde (kostprijs van laden + afschrijving + minimale winst)
+    charge_cost = avg_charge_price if marginal_cost is None else marginal_cost
+    cost_threshold = charge_cost + depreciation_per_kwh + min_profit
+    _LOGGER.info(
+        "Calculated cost Threshold: %.3f €/kWh <= %s charge (%.3f) + depreciation (%.3f) + min_profit (%.3f).",
+        cost_threshold, "average" if marginal_cost is None else "marginal", charge_cost, depreciation_per_kwh, min_profit
+    )
+
+    # Discharge schedule met controle op afschrijving en minimale winst
+    discharge_schedule = []
+    for item in most_expensive_periods:
+        if isinstance(item["datetime"], str):
+            time = datetime.fromisoformat(item["datetime"])
+        else:
+            time = item["datetime"]
+
+        price = item["electricity_price"] / 1e7  # Prijs omzetten naar €/kWh
+
+        # Controle: Alleen ontladen als de prijs hoger is dan de kostprijs
+        if _discharge_price(item, estimate_margin) > cost_threshold:
+            discharge_schedule.append({
+                "time": time, 
+                "price": price, 
+                "action": "discharge", 
+                "rate": discharge_rate
+            })
+
+            _LOGGER.debug(
+                "Adding discharge period at %s: Price %.2f €/kWh (Threshold: %.2f €/kWh).",
+                time, price, cost_threshold
+            )
+        else:
+            _LOGGER.debug(
+                "Skipping discharge period at %s: Price %.2f €/kWh is below threshold %.2f €/kWh.",
+                time, price, cost_threshold
+            )
+
+    # Reserve voor peak shaving: in tijdsvolgorde nooit onder de reserve ontladen
+    if reserve_kwh > 0:
+        energy = current_capacity
+        reserved_schedule = []
+        for period in sorted(charge_schedule + discharge_schedule, key=lambda x: x["time"].astimezone(timezone.utc)):
+            if period["action"] == "charge":
+                energy = min(energy + period["rate"], max_capacity)  # Blokken van 1 uur
+                continue
+            available_energy = min(period["rate"], energy - reserve_kwh)
+            if available_energy <= 0:
+                _LOGGER.debug("Skipping discharge period at %s: battery energy reserved for peak shaving.", period["time"])
+                continue
+            reserved_schedule.append({**period, "rate": round(available_energy, 3)})
+            energy -= available_energy
+        discharge_schedule = reserved_schedule
+
+    _LOGGER.debug("Calculated charge schedule: %s", charge_schedule)
+    _LOGGER.debug("Calculated discharge schedule: %s", discharge_schedule)
+
+    # Combine schedules
+    full_schedule = charge_schedule + discharge_schedule
+    full_schedule = sorted(full_schedule, key=lambda x: x["time"].astimezone(timezone.utc))
+
+    # Blokken met een geschatte prijs herkenbaar houden in het schema
+    estimated_times = {item["datetime"] for item in future_forecast if item.get("estimated")}
+    if estimated_times:
+        full_schedule = [
+            {**period, "estimated": True} if period["time"] in estimated_times else period
+            for period in full_schedule
+        ]
+
+    if power_curve is not None:
+        # Extra pre-peak blokken die nog onder de drempel liggen, goedkoopste eerst
+        charge_threshold = average_peak_price - (depreciation_per_kwh + min_profit)
+        candidates = []
+        for item in sorted(pre_peak_forecast, key=lambda x: _charge_price(x, estimate_margin)):
+            time = datetime.fromisoformat(item["datetime"]) if isinstance(item["datetime"], str) else item["datetime"]
+            price = item["electricity_price"] / 1e7
+            if _charge_price(item, estimate_margin) < charge_threshold and (time, "charge") not in seen_charge_times:
+                candidate = {"time": time, "price": price, "action": "charge", "rate": charge_rate}
+                if item.get("estimated"):
+                    candidate["estimated"] = True
+                candidates.append(candidate)
+
+        full_schedule = apply_power_curve(
+            full_schedule, candidates, current_capacity, max_capacity, power_curve, most_expensive_time
+        )
+
+    _LOGGER.info("Final optimal schedule: %s", full_schedule)
+
+    return full_schedule
+
+
+def _simulate(schedule, current_capacity, max_capacity, power_curve, steps=4):
+    """Return the schedule with the feasible energy per slot and the energy before each slot.
+
+    `rate` stays the power to command (kW), limited to what the curve allows
+    at the start SoC; the expected slot energy is added as `energy_kwh`.
+    """
+    energy = current_capacity
+    simulated = []
+    for period in schedule:
+        start_energy = energy
+        start_soc = energy / max_capacity if max_capacity else 0.0
+        if period["action"] == "charge":
+            rate = min(period["rate"], power_curve.charge_power(start_soc))
+        else:
+            rate = min(period["rate"], power_curve.discharge_power(start_soc))
+        for _ in range(steps):  # Blok van 1 uur in kwartieren doorrekenen
+            soc = energy / max_capacity if max_capacity else 0.0
+            if period["action"] == "charge":
+                power = min(period["rate"], power_curve.charge_power(soc))
+                energy = min(energy + power / steps, max_capacity)
+            else:
+                power = min(period["rate"], power_curve.discharge_power(soc))
+                energy = max(energy - power / steps, 0.0)
+        simulated.append((start_energy, {
+            **period, "rate": round(rate, 3), "energy_kwh": round(abs(energy - start_energy), 3)
+        }))
+    return simulated, energy
+
+
+def apply_power_curve(schedule, candidates, current_capacity, max_capacity, power_curve, peak_time, min_energy=0.01):
+    """Replace the constant rates by what the SoC-dependent power curve can deliver.
+
+    Charge slots that would add (almost) nothing are dropped. When the battery
+    would not be full at the start of the peak, cheap pre-peak `candidates`
+    are added one at a time.
+    """
+    candidates = list(candidates)
+    while True:
+        simulated, _ = _simulate(schedule, current_capacity, max_capacity, power_curve)
+        energy_at_peak = next(
+            (start_energy for start_energy, period in simulated
+             if period["time"].astimezone(timezone.utc) >= peak_time.astimezone(timezone.utc)), None
+        )
+        if energy_at_peak is None or energy_at_peak >= max_capacity - min_energy or not candidates:
+            break
+        extra = candidates.pop(0)
+        _LOGGER.debug(
+            "Adding charge period at %s: %.2f kWh short of full capacity before the peak at %s.",
+            extra["time"], max_capacity - energy_at_peak, peak_time
+        )
+        schedule = sorted(schedule + [extra], key=lambda x: x["time"].astimezone(timezone.utc))
+
+    result = []
+    for _, period in simulated:
+        if period["action"] == "charge" and period["energy_kwh"] < min_energy:
+            _LOGGER.debug("Skipping charge period at %s: battery is expected to be full.", period["time"])
+            continue
+        result.append(period)
+    return result
+
+
+def live_price_thresholds(schedule, forecast, now, horizon_hours, charge_cost, depreciation_per_kwh, min_profit, estimate_margin=0.0):
+    """Live prices (€/kWh) at which the plan of each slot in the horizon would change.
+
+    Uses the thresholds of calculate_optimal_schedule: discharging pays above
+    the cost of the stored energy plus depreciation and minimum profit,
+    charging below the average of the three most expensive slots minus
+    depreciation and minimum profit. A slot that is not planned for an action
+    only switches to it past the cheapest planned discharge or the most
+    expensive planned charge (or past every known price when none is planned).
+    Returns [{"start", "action", "price", "rate", "charge_below", "discharge_above"}].
+    """
+    now_utc = now.astimezone(timezone.utc)
+    future_forecast = _future_forecast(forecast, now_utc, now_utc + timedelta(hours=horizon_hours))
+    if not future_forecast:
+        return []
+
+    peaks = sorted((_discharge_price(item, estimate_margin) for item in future_forecast), reverse=True)[:3]
+    charge_threshold = sum(peaks) / len(peaks) - (depreciation_per_kwh + min_profit)
+    cost_threshold = charge_cost + depreciation_per_kwh + min_profit
+
+    planned = {period["time"].astimezone(timezone.utc): period for period in schedule}
+    charge_prices = [period["price"] for period in schedule if period["action"] == "charge"]
+    discharge_prices = [period["price"] for period in schedule if period["action"] == "discharge"]
+    prices = [item["electricity_price"] / 1e7 for item in future_forecast]
+    discharge_above = max(cost_threshold, min(discharge_prices) if discharge_prices else max(prices))
+    charge_below = min(charge_threshold, max(charge_prices) if charge_prices else min(prices))
+
+    thresholds = []
+    for item, price in zip(future_forecast, prices):
+        start = _slot_start(item)
+        period = planned.get(start)
+        action = period["action"] if period else "none"
+        thresholds.append({
+            "start": start,
+            "action": action,
+            "price": price,
+            "rate": period["rate"] if period else 0.0,
+            "charge_below": charge_threshold if action == "charge" else charge_below,
+            "discharge_above": cost_threshold if action == "discharge" else discharge_above,
+        })
+    return thresholds
+
+
+def redecide_slot(thresholds, live_price, current_capacity, max_capacity, reserve_kwh=0.0):
+    """Action for one slot at a live price, without planning the rest of the horizon again.
+
+    `thresholds` is an entry of live_price_thresholds. The plan only changes
+    when the live price crosses a threshold away from the day-ahead price, so
+    a live price equal to the day-ahead price keeps the planned action.
+    """
+    action = thresholds["action"]
+    day_ahead = thresholds["price"]
+    if live_price > thresholds["discharge_above"] and live_price > day_ahead and current_capacity > reserve_kwh:
+        return "discharge"
+    if live_price < thresholds["charge_below"] and live_price < day_ahead and current_capacity < max_capacity:
+        return "charge"
+    if action == "charge" and live_price > max(thresholds["charge_below"], day_ahead):
+        return "none"  # Laden is niet meer goedkoop genoeg
+    if action == "discharge" and live_price < min(thresholds["discharge_above"], day_ahead):
+        return "none"  # Ontladen levert minder op dan de kostprijs
+    return action
@@ -0,0 +1,129 @@
+"""Demand tracking for capacity-tariff peak shaving."""
+import math
+from datetime import datetime
+from zoneinfo import ZoneInfo
+
+QUARTER_HOUR = 900  # Seconden
+
+
+class SlidingWindowAverage:
+    """Time-weighted average power over the last `window` seconds, O(1) per sample."""
+
+    def __init__(self, window=QUARTER_HOUR, resolution=10):
+        self._window = window
+        self._resolution = resolution
+        self._size = int(window // resolution)
+        self._buckets = [0.0] * self._size  # Energie (W·s) per bucket
+        self._sum = 0.0
+        self._key = None  # Bucketnummer van de laatste sample
+        self._last_time = None
+        self._last_power = 0.0
+
+    def _advance(self, key):
+        """Clear the buckets that fall out of the window when moving to bucket `key`."""
+        steps = key - self._key
+        if steps >= self._size:
+            self._buckets = [0.0] * self._size
+            self._sum = 0.0
+        else:
+            for step in range(self._key + 1, key + 1):
+                index = step % self._size
+                self._sum -= self._buckets[index]
+                self._buckets[index] = 0.0
+                if index == 0:
+                    self._sum = math.fsum(self._buckets)  # Afrondingsfouten niet laten oplopen
+        self._key = key
+
+    def add(self, timestamp, power_w):
+        """Add a power sample, the previous sample is held until `timestamp`."""
+        if self._last_time is None:
+            self._key = int(timestamp // self._resolution)
+        else:
+            start = self._last_time
+            while start < timestamp:
+                key = int(start // self._resolution)
+                if key != self._key:
+                    self._advance(key)
+                end = min(timestamp, (key + 1) * self._resolution)
+                energy = self._last_power * (end - start)
+                self._buckets[key % self._size] += energy
+                self._sum += energy
+                start = end
+                if timestamp - start > self._window:
+                    start = timestamp - self._window  # Lange stilte: alleen het laatste venster telt
+        self._last_time = timestamp
+        self._last_power = power_w
+
+    def average(self):
+        """Average power (W) over the window."""
+        return self._sum / self._window
+
+
+class QuarterHourDemand:
+    """Average import of the running billing quarter-hour and the month-to-date peak."""
+
+    def __init__(self, time_zone):
+        self._local_tz = ZoneInfo(time_zone)
+        self._interval_start = None
+        self._energy = 0.0  # W·s in het lopende kwartier
+        self._last_time = None
+        self._last_power = 0.0
+        self._month = None
+        self.month_peak = 0.0  # Hoogste kwartiergemiddelde (W) deze maand, stijgt alleen
+
+    def _start_month(self, timestamp):
+        month = datetime.fromtimestamp(timestamp, self._local_tz).strftime("%Y-%m")
+        if month != self._month:
+            self._month = month
+            self.month_peak = 0.0
+
+    def _close_interval(self, start, average):
+        self._start_month(start)
+        if average > self.month_peak:
+            self.month_peak = average
+
+    def add(self, timestamp, import_w):
+        """Add a net import sample (W, export counts as zero demand)."""
+        import_w = max(import_w, 0.0)
+        interval_start = timestamp - timestamp % QUARTER_HOUR
+        if self._interval_start is None:
+            self._interval_start = interval_start
+            self._start_month(interval_start)
+        elif interval_start != self._interval_start:
+            # Vorige kwartier afmaken tot de grens en afsluiten
+            self._energy += self._last_power * (self._interval_start + QUARTER_HOUR - self._last_time)
+            self._close_interval(self._interval_start, self._energy / QUARTER_HOUR)
+            # Hele kwartieren zonder samples hadden het laatste vermogen
+            if interval_start - self._interval_start > QUARTER_HOUR:
+                self._close_interval(interval_start - QUARTER_HOUR, self._last_power)
+            self._start_month(interval_start)
+            self._energy = self._last_power * (timestamp - interval_start)
+            self._interval_start = interval_start
+        elif self._last_time is not None:
+            self._energy += self._last_power * (timestamp - self._last_time)
+        self._last_time = timestamp
+        self._last_power = import_w
+
+    def interval_average(self):
+        """Average import (W) of the running quarter-hour so far."""
+        if self._last_time is None:
+            return 0.0
+        elapsed = self._last_time - self._interval_start
+        return self._energy / elapsed if elapsed > 0 else self._last_power
+
+    def required_discharge(self, target_w, battery_w=0.0):
+        """Battery power (W) needed now to keep the quarter-hour average at or below the target.
+
+        `battery_w` is the current battery discharge, already subtracted from
+        the measured import; it is added back so the result is the discharge
+        for the household demand, not on top of what the battery already does.
+        """
+        if self._last_time is None:
+            return 0.0
+        # Een eerder kwartier deze maand bepaalt de rekening al, lager afvlakken levert niets op
+        target_w = max(target_w, self.month_peak)
+        remaining = self._interval_start + QUARTER_HOUR - self._last_time
+        if remaining <= 0:
+            return 0.0
+        allowed_w = (target_w * QUARTER_HOUR - self._energy) / remaining
+        return max(self._last_power + max(battery_w, 0.0) - allowed_w, 0.0)
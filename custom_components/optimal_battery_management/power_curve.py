@@ -0,0 +1,67 @@
+"""Learned charge/discharge power as a function of SoC."""
+
+
+class PowerCurve:
+    """Lookup table of achievable power (kW) per SoC bin, updated per sample in O(1)."""
+
+    def __init__(self, charge_rate, discharge_rate, bins=20, alpha=0.1, margin=0.1):
+        self._bins = bins
+        self._alpha = alpha  # Gewicht van een nieuwe meting
+        self._margin = margin  # Zoveel (relatief) onder het commando telt als een grens van de accu
+        self._charge_rate = charge_rate
+        self._discharge_rate = discharge_rate
+        self.charge = [float(charge_rate)] * bins  # kW per SoC-bin
+        self.discharge = [float(discharge_rate)] * bins
+
+    @classmethod
+    def from_dict(cls, data, charge_rate, discharge_rate):
+        """Build a curve from a stored table, e.g. a batch site config."""
+        curve = cls(charge_rate, discharge_rate, bins=len(data["charge"]))
+        curve.charge = [min(float(value), charge_rate) for value in data["charge"]]
+        curve.discharge = [min(float(value), discharge_rate) for value in data["discharge"]]
+        return curve
+
+    def as_dict(self):
+        return {"charge": [round(value, 3) for value in self.charge], "discharge": [round(value, 3) for value in self.discharge]}
+
+    def _bin(self, soc):
+        return min(max(int(soc * self._bins), 0), self._bins - 1)
+
+    def add_sample(self, soc, power_w, commanded_kw=None):
+        """Learn from a measurement taken during a scheduled slot.
+
+        power_w follows the power sensor: negative is charging, positive is
+        discharging. `commanded_kw` is the power sent to the inverter. Below the
+        configured rate (limited by this curve or the reserve) a sample only
+        counts when the battery stayed clearly under the command; otherwise it
+        shows the command, not the battery, and a bin could only go down.
+        Returns True when the sample was used.
+        """
+        if power_w < 0:
+            table, limit = self.charge, self._charge_rate
+        elif power_w > 0:
+            table, limit = self.discharge, self._discharge_rate
+        else:
+            return False
+        if commanded_kw is not None and commanded_kw < limit and abs(power_w) / 1000 >= commanded_kw * (1 - self._margin):
+            return False
+        index = self._bin(soc)
+        # Nooit meer dan de ingestelde snelheid, die wordt ook aan de omvormer gevraagd
+        table[index] += self._alpha * (min(abs(power_w) / 1000, limit) - table[index])
+        return True
+
+    def _interpolate(self, table, soc):
+        position = soc * self._bins - 0.5  # Waarden horen bij het midden van een bin
+        if position <= 0:
+            return table[0]
+        if position >= self._bins - 1:
+            return table[-1]
+        index = int(position)
+        fraction = position - index
+        return table[index] + (table[index + 1] - table[index]) * fraction
+
+    def charge_power(self, soc):
+        return self._interpolate(self.charge, soc)
+
+    def discharge_power(self, soc):
+        return self._interpolate(self.discharge, soc)
@@ -0,0 +1,119 @@
+"""Seasonal price estimate for the hours after the last published day-ahead price."""
+import json
+import logging
+import os
+from datetime import datetime, timedelta, timezone
+from zoneinfo import ZoneInfo
+
+_LOGGER = logging.getLogger(__name__)
+
+STATE_VERSION = 1
+
+
+class SeasonalPriceModel:
+    """Daily and weekly price profiles, learned with an exponential moving average.
+
+    The estimate for a local hour is the daily profile for that hour plus the
+    weekly deviation for that hour of the week. Each published slot is learned
+    once, so a day of prices costs O(slots). Until a profile has seen
+    `1 / alpha` samples the average is plain (weight 1 / count).
+    """
+
+    def __init__(self, time_zone, path=None, alpha_day=0.15, alpha_week=0.25, min_days=3):
+        self._local_tz = ZoneInfo(time_zone)
+        self.path = path  # JSON-bestand met de profielen, None houdt alles in het geheugen
+        self._alpha_day = alpha_day
+        self._alpha_week = alpha_week
+        self._min_days = min_days  # Pas schatten als elk uur zo vaak gezien is
+        self.daily = [0.0] * 24  # €/kWh per lokaal uur
+        self.daily_count = [0] * 24
+        self.weekly = [0.0] * 168  # Afwijking van het dagprofiel per uur van de week
+        self.weekly_count = [0] * 168
+        self.last_learned = None  # UTC start van het laatst geleerde blok
+        self.dirty = False
+
+    @property
+    def ready(self):
+        return min(self.daily_count) >= self._min_days
+
+    def load(self):
+        """Read the state file, a missing or invalid file starts empty."""
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, encoding="utf-8") as file:
+                data = json.load(file)
+            if data.get("version") != STATE_VERSION:
+                raise ValueError(f"unsupported version {data.get('version')}")
+            self.daily, self.daily_count = data["daily"], data["daily_count"]
+            self.weekly, self.weekly_count = data["weekly"], data["weekly_count"]
+            self.last_learned = datetime.fromisoformat(data["last_learned"]) if data.get("last_learned") else None
+        except (OSError, KeyError, TypeError, ValueError) as e:
+            _LOGGER.warning(f"Ignoring price model state {self.path}: {e}")
+
+    def save(self):
+        """Write the state file (a few KB) when something was learned."""
+        if not self.path or not self.dirty:
+            return
+        data = {
+            "version": STATE_VERSION,
+            "daily": [round(value, 5) for value in self.daily],
+            "daily_count": self.daily_count,
+            "weekly": [round(value, 5) for value in self.weekly],
+            "weekly_count": self.weekly_count,
+            "last_learned": self.last_learned.isoformat() if self.last_learned else None,
+        }
+        temporary = f"{self.path}.tmp"
+        try:
+            with open(temporary, "w", encoding="utf-8") as file:
+                json.dump(data, file)
+            os.replace(temporary, self.path)  # Nooit een half geschreven bestand achterlaten
+        except OSError as e:
+            # Alleen-lezen of volle schijf: in het geheugen doorleren, later opnieuw proberen
+            _LOGGER.error(f"Failed to save price model state to {self.path}: {e}")
+            return
+        self.dirty = False
+
+    def learn(self, slots):
+        """Learn from forecast items (sorted, local "datetime") not seen before."""
+        for item in slots:
+            if item.get("estimated"):
+                continue
+            start = item["datetime"].astimezone(timezone.utc)
+            if self.last_learned is not None and start <= self.last_learned:
+                continue
+            local = item["datetime"].astimezone(self._local_tz)
+            price = item["electricity_price"] / 1e7
+            hour = local.hour
+            week_hour = local.weekday() * 24 + hour
+
+            self.daily_count[hour] += 1
+            self.daily[hour] += max(self._alpha_day, 1 / self.daily_count[hour]) * (price - self.daily[hour])
+            self.weekly_count[week_hour] += 1
+            self.weekly[week_hour] += max(self._alpha_week, 1 / self.weekly_count[week_hour]) * (
+                price - self.daily[hour] - self.weekly[week_hour]
+            )
+            self.last_learned = start
+            self.dirty = True
+
+    def estimate(self, start):
+        """Estimated price (€/kWh) for the slot starting at `start`."""
+        local = start.astimezone(self._local_tz)
+        week_hour = local.weekday() * 24 + local.hour
+        return self.daily[local.hour] + (self.weekly[week_hour] if self.weekly_count[week_hour] else 0.0)
+
+    def extend(self, slots, end):
+        """Return estimated forecast items from the last slot in `slots` up to `end`."""
+        if not self.ready or not slots:
+            return []
+        start = slots[-1]["datetime"].astimezone(timezone.utc) + timedelta(hours=1)
+        end = end.astimezone(timezone.utc)
+        estimated = []
+        while start < end:
+            estimated.append({
+                "datetime": start.astimezone(self._local_tz),
+                "electricity_price": int(round(self.estimate(start) * 1e7)),
+                "estimated": True,
+            })
+            start += timedelta(hours=1)
+        return estimated
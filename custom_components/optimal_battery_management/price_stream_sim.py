@@ -0,0 +1,99 @@
+"""Local stand-in for a live price feed, for testing `live_prices` without a supplier.
+
+Run with: python price_stream_sim.py --port 5021 --interval 1 --spike 0.05
+"""
+import argparse
+import asyncio
+import json
+import logging
+import random
+from datetime import datetime, timezone
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class PriceStreamSimulator:
+    """TCP server that sends a random-walk price with occasional spikes to every client, one JSON line each."""
+
+    def __init__(self, host="127.0.0.1", port=5021, interval=1.0, price=0.25, spike_chance=0.0, seed=None):
+        self.host = host
+        self.port = port
+        self.interval = interval
+        self.price = price  # €/kWh
+        self._spike_chance = spike_chance
+        self._rng = random.Random(seed)
+        self._clients = set()
+        self._server = None
+        self._task = None
+        self.sent = 0
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle_client, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        self._task = asyncio.get_running_loop().create_task(self._publish())
+        _LOGGER.info(f"Price stream simulator listening on {self.host}:{self.port}")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+        if self._server is not None:
+            self._server.close()
+            for writer in list(self._clients):
+                writer.close()
+            await self._server.wait_closed()
+
+    def next_price(self):
+        self.price = max(self.price + self._rng.gauss(0, 0.01), -0.1)
+        if self._rng.random() < self._spike_chance:
+            return round(self.price + self._rng.choice((-1, 1)) * self._rng.uniform(0.3, 1.0), 4)
+        return round(self.price, 4)
+
+    def send(self, price, when=None):
+        """Send one price to every client (also used by tests to inject exact values)."""
+        when = when or datetime.now(timezone.utc)
+        line = json.dumps({"time": when.isoformat().replace("+00:00", "Z"), "price": price}) + "\n"
+        for writer in list(self._clients):
+            writer.write(line.encode())
+        self.sent += 1
+
+    async def _publish(self):
+        while True:
+            self.send(self.next_price())
+            # Trage clients: buffer per client begrenzen door te wachten
+            for writer in list(self._clients):
+                try:
+                    await writer.drain()
+                except ConnectionError:
+                    self._clients.discard(writer)
+            await asyncio.sleep(self.interval)
+
+    async def _handle_client(self, reader, writer):
+        self._clients.add(writer)
+        try:
+            await reader.read()  # Wachten tot de client de verbinding sluit
+        except ConnectionError:
+            pass
+        finally:
+            self._clients.discard(writer)
+            writer.close()
+
+
+async def _serve(args):
+    simulator = PriceStreamSimulator(args.host, args.port, args.interval, spike_chance=args.spike, seed=args.seed)
+    await simulator.start()
+    await asyncio.Event().wait()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local live price feed stand-in")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5021)
+    parser.add_argument("--interval", type=float, default=1.0, help="seconds between prices")
+    parser.add_argument("--spike", type=float, default=0.05, help="chance of a price spike per message")
+    parser.add_argument("--seed", type=int)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.DEBUG)
+    try:
+        asyncio.run(_serve(args))
+    except KeyboardInterrupt:
+        pass
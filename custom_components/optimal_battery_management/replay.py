@@ -0,0 +1,231 @@
+"""Replay a captured input log through the sensors as fast as possible.
+
+Run with: python -m custom_components.optimal_battery_management.replay capture.bin.1 capture.bin --config config.json
+"""
+import argparse
+import heapq
+import itertools
+import json
+import logging
+import math
+import mmap
+import time
+import types
+from datetime import datetime, timezone
+
+from . import sensor
+from .capture import KIND_FORECAST, KIND_FORECAST_SLOT, KIND_POWER, KIND_SOC, KIND_TARIFF, RECORD
+from .clock import DATA_CLOCK, VirtualClock
+from .timeseries import TimeSeriesStore
+
+_LOGGER = logging.getLogger(__name__)
+
+
+def iter_records(path):
+    """Yield (timestamp, kind, aux, value) from a memory-mapped capture file."""
+    with open(path, "rb") as file:
+        if file.seek(0, 2) < RECORD.size:
+            return
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            # Een half geschreven laatste record negeren
+            view = memoryview(mapped)[:len(mapped) - len(mapped) % RECORD.size]
+            records = RECORD.iter_unpack(view)
+            try:
+                yield from records
+            finally:
+                del records
+                view.release()
+
+
+class _State:
+    def __init__(self, state, attributes=None):
+        self.state = state
+        self.attributes = attributes or {}
+
+
+class _States:
+    """The part of hass.states the sensors use."""
+
+    def __init__(self, on_set=None):
+        self._states = {}
+        self._on_set = on_set  # Aangeroepen met (entity_id, state), zoals een state change event
+
+    def get(self, entity_id):
+        return self._states.get(entity_id)
+
+    def set(self, entity_id, state, attributes=None):
+        self._states[entity_id] = _State(state, attributes)
+        if self._on_set is not None:
+            self._on_set(entity_id, state)
+
+
+class InputReplay:
+    """Feed captured events through the sensors and calculate_optimal_schedule."""
+
+    def __init__(self, config, time_zone="Europe/Amsterdam", statistics=None, output=None):
+        self.clock = VirtualClock(datetime.fromtimestamp(0, timezone.utc))
+        self.store = TimeSeriesStore()
+        self.hass = types.SimpleNamespace(
+            states=_States(self._record_input), config=types.SimpleNamespace(time_zone=time_zone),
+            data={DATA_CLOCK: self.clock, sensor.DATA_STORE: self.store},
+        )
+        self._entity_ids = {
+            KIND_TARIFF: config["tariff_sensor"],
+            KIND_SOC: config["soc_sensor"],
+            KIND_POWER: config["power_sensor"],
+        }
+        self._input_ids = set(self._entity_ids.values())
+        max_capacity = config.get("max_capacity", 5.12)
+        hass = self.hass
+        tariff_sensor, soc_sensor, power_sensor = (
+            config["tariff_sensor"], config["soc_sensor"], config["power_sensor"]
+        )
+
+        power_curve = sensor.PowerCurve(config.get("charge_rate", 0.8), config.get("discharge_rate", 0.8))
+        self.ledger = sensor.CostBasisLedger(config.get("max_cost_lots", 48))
+        self.price_model = sensor.SeasonalPriceModel(time_zone) if config.get("price_forecast") else None  # Alleen in het geheugen
+        self.schedule_sensor = sensor.OptimalBatteryManagementSensor(hass, config, power_curve, self.ledger, self.price_model)
+        self.charge_mode_sensor = sensor.OptimalChargeModeSensor(hass, f"sensor.{sensor.DOMAIN}", output)
+        self.charge_mode_sensor._schedule_transition = self._schedule_transition  # Blokgrenzen op de virtuele klok
+        self.statistics = statistics  # Optionele HourlyEnergyStatistics
+        self.entities = {
+            f"sensor.{sensor.DOMAIN}": self.schedule_sensor,
+            "sensor.optimal_charge_mode": self.charge_mode_sensor,
+            "sensor.average_charge_price": sensor.AvgChargePriceSensor(hass, power_sensor, tariff_sensor, soc_sensor, max_capacity, statistics=statistics, ledger=self.ledger),
+            "sensor.average_discharge_price": sensor.AvgDisChargePriceSensor(hass, power_sensor, tariff_sensor, soc_sensor, max_capacity, statistics=statistics),
+            "sensor.charging_efficiency": sensor.ChargingEfficiencySensor(hass, power_sensor, soc_sensor, max_capacity, power_curve=power_curve),
+            "sensor.discharging_efficiency": sensor.DisChargingEfficiencySensor(hass, power_sensor, soc_sensor, max_capacity, power_curve=power_curve),
+        }
+        for entity_id, entity in self.entities.items():
+            entity.schedule_update_ha_state = self._state_writer(entity_id, entity)
+
+        self._timers = []  # heap van (tijdstip, volgnummer, actie)
+        self._sequence = itertools.count()
+        self._started = False
+        self._forecast = []
+        self._forecast_expected = 0
+        self.transitions = []  # (tijdstip, charge mode)
+        self.events = 0
+
+    def _record_input(self, entity_id, state):
+        if entity_id in self._input_ids:
+            self.store.add_state(entity_id, self.clock.now().timestamp(), state)
+
+    def _state_writer(self, entity_id, entity):
+        def _write(force_refresh=False):
+            state = entity.state
+            if entity is self.charge_mode_sensor and (not self.transitions or self.transitions[-1][1] != state):
+                self.transitions.append((self.clock.now(), state))
+            self.hass.states.set(entity_id, str(state), dict(getattr(entity, "extra_state_attributes", None) or {}))
+        return _write
+
+    def _call_at(self, when, action):
+        heapq.heappush(self._timers, (when, next(self._sequence), action))
+
+    def _poller(self, entity):
+        def _poll(when):
+            entity.update()
+            self._call_at(when + entity.scan_interval, _poll)
+        return _poll
+
+    def _schedule_transition(self, when):
+        """Replacement for OptimalChargeModeSensor._schedule_transition on the virtual clock."""
+        charge_mode = self.charge_mode_sensor
+        if when == charge_mode._next_transition:
+            return
+        charge_mode._next_transition = when
+        if when is None:
+            return
+
+        def _fire(now):
+            # Een verouderde timer vuurt nog wel, maar doet niets meer
+            if charge_mode._next_transition == when:
+                charge_mode._handle_transition(now)
+
+        self._call_at(when, _fire)
+
+    def advance(self, now):
+        """Run the timers HA would have fired up to `now`, in time order."""
+        if not self._started:
+            self._started = True
+            for entity in self.entities.values():
+                self._call_at(now, self._poller(entity))
+        while self._timers and self._timers[0][0] <= now:
+            when, _, action = heapq.heappop(self._timers)
+            self.clock.set(when)
+            action(when)
+        self.clock.set(now)
+
+    def _trigger(self, trigger):
+        self.schedule_sensor._last_trigger = trigger
+        self.schedule_sensor.update()
+
+    def feed(self, timestamp, kind, aux, value):
+        """Apply one captured record."""
+        self.events += 1
+        self.advance(datetime.fromtimestamp(timestamp, timezone.utc))
+        state = "unavailable" if math.isnan(value) else repr(value)
+
+        if kind == KIND_TARIFF:
+            previous = self.hass.states.get(self._entity_ids[KIND_TARIFF])
+            self.hass.states.set(self._entity_ids[KIND_TARIFF], state, previous.attributes if previous else {})
+            self._trigger("tariff_sensor change")
+        elif kind == KIND_FORECAST:
+            self._forecast = []
+            self._forecast_expected = aux
+        elif kind == KIND_FORECAST_SLOT:
+            start = datetime.fromtimestamp(aux, timezone.utc)
+            self._forecast.append({
+                "datetime": start.strftime("%Y-%m-%dT%H:%M:%S.000000Z"),
+                "electricity_price": int(value),
+            })
+            if len(self._forecast) == self._forecast_expected:
+                tariff = self.hass.states.get(self._entity_ids[KIND_TARIFF])
+                self.hass.states.set(
+                    self._entity_ids[KIND_TARIFF], tariff.state if tariff else "unknown", {"forecast": self._forecast}
+                )
+                self._trigger("tariff_sensor change")
+        elif kind == KIND_SOC:
+            self.hass.states.set(self._entity_ids[KIND_SOC], state)
+            self._trigger("soc_sensor change")
+        elif kind == KIND_POWER:
+            self.hass.states.set(self._entity_ids[KIND_POWER], state)
+
+    def run(self, paths):
+        """Replay the given capture files (oldest first)."""
+        for path in paths:
+            for record in iter_records(path):
+                self.feed(*record)
+
+    def summary(self):
+        return {
+            "events": self.events,
+            "transitions": [(when.isoformat(), mode) for when, mode in self.transitions],
+            "states": {entity_id: entity.state for entity_id, entity in self.entities.items()},
+            "ledger": self.ledger.as_dict(),
+        }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay captured Optimal Battery Management inputs")
+    parser.add_argument("paths", nargs="+", help="capture files, oldest first")
+    parser.add_argument("--config", required=True, help="JSON file with the integration configuration")
+    parser.add_argument("--time-zone", default="Europe/Amsterdam")
+    args = parser.parse_args(argv)
+
+    with open(args.config, encoding="utf-8") as file:
+        config = json.load(file)
+
+    replay = InputReplay(config, args.time_zone)
+    started = time.perf_counter()
+    replay.run(args.paths)
+    elapsed = time.perf_counter() - started
+
+    summary = replay.summary()
+    summary["seconds"] = round(elapsed, 3)
+    summary["events_per_second"] = round(replay.events / elapsed) if elapsed else None
+    print(json.dumps(summary, indent=2, default=str))
+
+
+if __name__ == "__main__":
+    main()
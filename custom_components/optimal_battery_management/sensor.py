@@ -1,12 +1,166 @@
 import logging
-from datetime import datetime, timedelta
+import threading
+from datetime import datetime, timedelta, timezone
 from zoneinfo import ZoneInfo
 from homeassistant.components.sensor import SensorEntity
-from homeassistant.helpers.event import async_track_state_change_event
+from homeassistant.const import EVENT_HOMEASSISTANT_STOP
+from homeassistant.core import callback
+from homeassistant.helpers.event import (
+    async_track_state_change_event,
+    async_track_time_interval,
+    async_track_utc_time_change,
+    track_point_in_time,
+)
+
+from .capture import KIND_POWER, KIND_SOC, KIND_TARIFF, InputRecorder
+from .clock import get_clock
+from .energy_statistics import HourlyEnergyStatistics
+from .forecast import MAX_HORIZON_HOURS, ForecastCache
+from .grid_control import GridLimitController
+from .inverter import InverterOutputDriver
+from .live_prices import PriceStreamClient
+from .ledger import CostBasisLedger
+from .optimizer import calculate_optimal_schedule, live_price_thresholds, redecide_slot
+from .power_curve import PowerCurve
+from .price_model import SeasonalPriceModel
+from .timeseries import TimeSeriesStore
+from .peak_shaving import QuarterHourDemand, SlidingWindowAverage
 
 _LOGGER = logging.getLogger(__name__)
 
 DOMAIN = "optimal_battery_management"
+DATA_STORE = f"{DOMAIN}_timeseries"  # Gedeelde TimeSeriesStore in hass.data
+
+
+def _states_equal(old, new, tolerance):
+    """Compare two states, numeric values within `tolerance`, everything else structurally."""
+    if (
+        isinstance(old, (int, float)) and isinstance(new, (int, float))
+        and not isinstance(old, bool) and not isinstance(new, bool)
+    ):
+        return abs(old - new) <= tolerance
+    return old == new
+
+
+class PowerCurveLearnerMixin:
+    """Feed power/SoC samples to the shared PowerCurve."""
+
+    _power_curve = None
+    _grid_controller = None
+
+    def _learn_power_curve(self, mode, soc, power_w):
+        # Alleen leren tijdens een gepland blok, met het vermogen dat de omvormer gevraagd is
+        if self._power_curve is None:
+            return
+        if self._grid_controller is not None and self._grid_controller.limiting:
+            return  # De netlimiet knijpt het vermogen af, dat zegt niets over de accu
+        charge_mode = self.hass.states.get("sensor.optimal_charge_mode")
+        if charge_mode is not None and charge_mode.state == mode:
+            self._power_curve.add_sample(soc, power_w, charge_mode.attributes.get("rate"))
+
+
+class EnergyIntegratorMixin:
+    """Energy between two updates, integrated from the shared TimeSeriesStore.
+
+    Without the store (or history) one minute of the current power is used,
+    as the sensors did before. Unavailable power counts as zero.
+    """
+
+    _energy_time = None
+    _tariff_sensor = None
+
+    def _energy_since_last(self, power_value, now):
+        """Return (charged, discharged) kWh since the previous call."""
+        charged, discharged, _, _ = self._energy_and_cost_since_last(power_value, now)
+        return charged, discharged
+
+    def _energy_and_cost_since_last(self, power_value, now, tariff_value=0.0):
+        """Return (charged kWh, discharged kWh, charge cost, discharge revenue) since the previous call.
+
+        Cost and revenue (EUR) follow the tariff history, so an interval that
+        spans a tariff change is priced per part; `tariff_value` fills gaps.
+        """
+        timestamp = now.timestamp()
+        last, self._energy_time = self._energy_time, timestamp
+        store = self.hass.data.get(DATA_STORE)
+        if store is not None and last is not None and store.covers(self._power_sensor, last):
+            charged = -store.integrate(self._power_sensor, last, timestamp, upper=0.0) / 3600000
+            discharged = store.integrate(self._power_sensor, last, timestamp, lower=0.0) / 3600000
+            if self._tariff_sensor is None:
+                return charged, discharged, charged * tariff_value, discharged * tariff_value
+            cost = -store.integrate_product(
+                self._power_sensor, self._tariff_sensor, last, timestamp, upper=0.0, default=tariff_value
+            ) / 3600000
+            revenue = store.integrate_product(
+                self._power_sensor, self._tariff_sensor, last, timestamp, lower=0.0, default=tariff_value
+            ) / 3600000
+            return charged, discharged, cost, revenue
+        energy = abs(power_value) / (60 * 1000)  # kWh per minuut
+        if power_value < 0:
+            return energy, 0.0, energy * tariff_value, 0.0
+        return 0.0, energy, 0.0, energy * tariff_value
+
+
+class PublishOnChangeMixin:
+    """Write state to Home Assistant only when state or attributes changed.
+
+    Polling via HA would write the state after every update, so the entities
+    schedule their own updates and publish through `_publish_state`.
+    """
+
+    _tolerance = 0.0
+    _published = None
+    published_writes = 0
+    suppressed_writes = 0
+
+    @property
+    def should_poll(self):
+        """Updates run on an own timer, see async_added_to_hass."""
+        return False
+
+    async def async_added_to_hass(self):
+        """Start the periodic update timer."""
+        await super().async_added_to_hass()
+        self.async_on_remove(
+            async_track_time_interval(self.hass, self._async_scheduled_update, self.scan_interval)
+        )
+
+    async def _async_scheduled_update(self, now):
+        await self.hass.async_add_executor_job(self._locked_update)
+
+    def _locked_update(self):
+        """Run update() in the executor, never two at the same time for this entity.
+
+        The timer, input events and slot boundaries all schedule an update;
+        HA's own update path serialised them, this lock keeps doing that.
+        """
+        lock = self.__dict__.setdefault("_update_lock", threading.Lock())
+        with lock:
+            self.update()
+
+    def _now(self, tz=timezone.utc):
+        """Current time from the clock in hass.data (virtual during replay and simulation)."""
+        return get_clock(self.hass).now(tz)
+
+    def _publish_state(self):
+        """Schedule a state write, unless nothing changed since the last one."""
+        state = self.state
+        attributes = self.extra_state_attributes
+        if self._published is not None:
+            published_state, published_attributes = self._published
+            if _states_equal(published_state, state, self._tolerance) and published_attributes == attributes:
+                self.suppressed_writes += 1
+                self._update_publish_stats()
+                return
+
+        self._published = (state, attributes)
+        self.published_writes += 1
+        self._update_publish_stats()
+        self.schedule_update_ha_state()
+
+    def _update_publish_stats(self):
+        stats = self.hass.data.setdefault(f"{DOMAIN}_publish_stats", {})
+        stats[self.name] = {"published": self.published_writes, "suppressed": self.suppressed_writes}
 
 
 async def async_setup_platform(hass, config, async_add_entities, discovery_info=None):
@@ -25,28 +179,188 @@ async def async_setup_platform(hass, config, async_add_entities, discovery_info=
         )
         return
 
-    optimal_schedule_sensor = OptimalBatteryManagementSensor(hass, discovery_info)
-    optimal_charge_mode_sensor = OptimalChargeModeSensor(hass, f"sensor.{DOMAIN}")
-    optimal_avg_charge_price_sensor = AvgChargePriceSensor(hass, power_sensor, tariff_sensor, soc_sensor, max_capacity)
-    optimal_avg_discharge_price_sensor = AvgDisChargePriceSensor(hass, power_sensor, tariff_sensor, soc_sensor, max_capacity)
-    optimal_charging_efficiency_sensor = ChargingEfficiencySensor(hass, power_sensor, soc_sensor, max_capacity)
-    optimal_discharging_efficiency_sensor = DisChargingEfficiencySensor(hass, power_sensor, soc_sensor, max_capacity)
+    # Optionele directe aansturing van de omvormer via Modbus TCP
+    output_driver = None
+    if discovery_info.get("inverter_output"):
+        try:
+            output_driver = InverterOutputDriver(hass, discovery_info["inverter_output"])
+        except ValueError as e:
+            _LOGGER.error(f"Invalid inverter_output configuration: {e}")
+        else:
+            await output_driver.async_start()
+            hass.bus.async_listen_once(EVENT_HOMEASSISTANT_STOP, output_driver.async_stop)
 
-    # Voeg de sensoren toe
-    async_add_entities([
+    # Gedeelde geschiedenis van de invoersensoren (vast geheugengebruik)
+    _async_setup_store(hass, [tariff_sensor, soc_sensor, power_sensor])
+
+    # Optioneel alle invoer vastleggen voor offline replay
+    if discovery_info.get("capture"):
+        _async_setup_capture(
+            hass, discovery_info["capture"],
+            {tariff_sensor: KIND_TARIFF, soc_sensor: KIND_SOC, power_sensor: KIND_POWER},
+        )
+
+    # Uurtotalen van energie, kosten en opbrengst als lange termijn statistieken
+    statistics = None
+    if discovery_info.get("long_term_statistics", True) and "recorder" in hass.config.components:
+        statistics = HourlyEnergyStatistics(
+            discovery_info.get("depreciation_per_kwh", 0.065), discovery_info.get("statistics_batch_hours", 1)
+        )
+
+        async def _async_flush_statistics(now):
+            await statistics.async_flush(hass, now)
+
+        async def _async_flush_statistics_on_stop(event):
+            await statistics.async_flush(hass, get_clock(hass).now(), force=True)
+
+        async_track_utc_time_change(hass, _async_flush_statistics, minute=1, second=0)
+        hass.bus.async_listen_once(EVENT_HOMEASSISTANT_STOP, _async_flush_statistics_on_stop)
+
+    tolerance = discovery_info.get("publish_tolerance", 0.0)  # Numerieke wijziging die nog niet gepubliceerd wordt
+
+    # Gedeelde tabel van haalbaar laad-/ontlaadvermogen per SoC
+    power_curve = PowerCurve(discovery_info.get("charge_rate", 0.8), discovery_info.get("discharge_rate", 0.8))
+
+    # Kostprijs per geladen lot, FIFO afgeboekt bij ontladen
+    ledger = CostBasisLedger(discovery_info.get("max_cost_lots", 48))
+
+    # Optioneel geschatte prijzen na het laatste gepubliceerde uur
+    price_model = None
+    if discovery_info.get("price_forecast"):
+        price_forecast = discovery_info["price_forecast"] if isinstance(discovery_info["price_forecast"], dict) else {}
+        price_model = SeasonalPriceModel(
+            hass.config.time_zone, price_forecast.get("path", hass.config.path(f"{DOMAIN}_prices.json"))
+        )
+        await hass.async_add_executor_job(price_model.load)
+
+    # Optioneel het blokvermogen per netmeting bijsturen voor een aansluitlimiet en nul-export
+    grid_controller = None
+    grid_limit = discovery_info.get("grid_limit")
+    if grid_limit:
+        if not grid_limit.get("grid_power_sensor"):
+            _LOGGER.error("grid_limit requires a grid_power_sensor. Please check your configuration.yaml")
+        elif output_driver is None:
+            _LOGGER.error("grid_limit requires a working inverter_output. Please check your configuration.yaml")
+        else:
+            grid_controller = GridLimitController(
+                output_driver,
+                import_limit_kw=grid_limit.get("import_limit_kw"),
+                zero_export=grid_limit.get("zero_export", False),
+                export_target_kw=grid_limit.get("export_target_kw", 0.0),
+                deadband_kw=grid_limit.get("deadband_kw", 0.05),
+                gain=grid_limit.get("gain", 0.8),
+                loop=hass.loop,
+            )
+
+    optimal_schedule_sensor = OptimalBatteryManagementSensor(hass, discovery_info, power_curve, ledger, price_model)
+    optimal_charge_mode_sensor = OptimalChargeModeSensor(hass, f"sensor.{DOMAIN}", grid_controller or output_driver)
+    optimal_avg_charge_price_sensor = AvgChargePriceSensor(hass, power_sensor, tariff_sensor, soc_sensor, max_capacity, tolerance, statistics, ledger)
+    optimal_avg_discharge_price_sensor = AvgDisChargePriceSensor(hass, power_sensor, tariff_sensor, soc_sensor, max_capacity, tolerance, statistics)
+    optimal_charging_efficiency_sensor = ChargingEfficiencySensor(hass, power_sensor, soc_sensor, max_capacity, tolerance, power_curve, grid_controller)
+    optimal_discharging_efficiency_sensor = DisChargingEfficiencySensor(hass, power_sensor, soc_sensor, max_capacity, tolerance, power_curve, grid_controller)
+
+    entities = [
         optimal_schedule_sensor,
         optimal_charge_mode_sensor,
         optimal_avg_charge_price_sensor,
         optimal_avg_discharge_price_sensor,
         optimal_charging_efficiency_sensor,
-        optimal_discharging_efficiency_sensor])
+        optimal_discharging_efficiency_sensor]
+
+    # Optioneel: pieken in de kwartierafname afvlakken (capaciteitstarief)
+    peak_shaving = discovery_info.get("peak_shaving")
+    if peak_shaving:
+        if peak_shaving.get("grid_power_sensor"):
+            entities.append(PeakShavingSensor(
+                hass, peak_shaving, soc_sensor, discovery_info.get("discharge_rate", 0.8), tolerance, power_sensor
+            ))
+        else:
+            _LOGGER.error("peak_shaving requires a grid_power_sensor. Please check your configuration.yaml")
+
+    if grid_controller is not None:
+        entities.append(GridLimitSensor(hass, grid_limit["grid_power_sensor"], grid_controller))
+
+    # Optioneel live intraday-/onbalansprijzen die het lopende blok kunnen herbeslissen
+    live_prices = discovery_info.get("live_prices")
+    if live_prices:
+        if live_prices.get("url"):
+            entities.append(LivePriceSensor(
+                hass, discovery_info, optimal_schedule_sensor, optimal_charge_mode_sensor
+            ))
+        else:
+            _LOGGER.error("live_prices requires a url. Please check your configuration.yaml")
+
+    # Voeg de sensoren toe
+    async_add_entities(entities)
         
     hass.data["avg_charge_price"] = 0.0  # Initialiseer de variabele
 
-class OptimalBatteryManagementSensor(SensorEntity):
-    def __init__(self, hass, config):
+
+def _async_setup_store(hass, entity_ids):
+    """Record every numeric state of the input sensors in the shared TimeSeriesStore."""
+    store = hass.data[DATA_STORE] = TimeSeriesStore()
+
+    @callback
+    def _handle_input_event(event):
+        new_state = event.data.get("new_state")
+        if new_state is not None:
+            store.add_state(event.data["entity_id"], new_state.last_updated.timestamp(), new_state.state)
+
+    for entity_id in entity_ids:
+        state = hass.states.get(entity_id)
+        if state is not None:
+            store.add_state(entity_id, state.last_updated.timestamp(), state.state)
+
+    async_track_state_change_event(hass, entity_ids, _handle_input_event)
+
+
+def _async_setup_capture(hass, capture_config, kinds):
+    """Append every state change of the input sensors to the binary capture log."""
+    recorder = InputRecorder(
+        capture_config.get("path", hass.config.path(f"{DOMAIN}_capture.bin")),
+        max_bytes=capture_config.get("max_bytes", 16 * 1024 * 1024),
+        backups=capture_config.get("backups", 3),
+    )
+
+    def _record(entity_id, state):
+        timestamp = state.last_updated.timestamp()
+        recorder.record_state(timestamp, kinds[entity_id], state.state)
+        if kinds[entity_id] == KIND_TARIFF:
+            recorder.record_forecast(timestamp, state.attributes.get("forecast") or [])
+
+    @callback
+    def _handle_input_event(event):
+        new_state = event.data.get("new_state")
+        if new_state is None:
+            return
+        _record(event.data["entity_id"], new_state)
+        if recorder.pending_bytes >= recorder.flush_bytes:
+            hass.async_add_executor_job(recorder.flush)
+
+    @callback
+    def _flush(*_):
+        hass.async_add_executor_job(recorder.flush)
+
+    # Beginstand vastleggen zodat een replay niet leeg begint
+    for entity_id in kinds:
+        state = hass.states.get(entity_id)
+        if state is not None:
+            _record(entity_id, state)
+
+    async_track_state_change_event(hass, list(kinds), _handle_input_event)
+    async_track_time_interval(hass, _flush, timedelta(seconds=capture_config.get("flush_interval", 30)))
+    hass.bus.async_listen_once(EVENT_HOMEASSISTANT_STOP, _flush)
+    _LOGGER.info(f"Capturing input events to {recorder.path}")
+
+class OptimalBatteryManagementSensor(PublishOnChangeMixin, SensorEntity):
+    def __init__(self, hass, config, power_curve=None, ledger=None, price_model=None):
         """Initialize the sensor."""
         self.hass = hass
+        self._power_curve = power_curve  # Optionele PowerCurve, anders vaste charge_rate/discharge_rate
+        self._ledger = ledger  # Optioneel CostBasisLedger, levert de marginale kostprijs
+        self._price_model = price_model  # Optioneel SeasonalPriceModel voor uren zonder prijs
+        price_forecast = config.get("price_forecast")
+        self._estimate_margin = (price_forecast.get("estimate_margin", 0.02) if isinstance(price_forecast, dict) else 0.02)  # €/kWh
         self._state = None
         self._attributes = {}
         self._tariff_sensor = config.get("tariff_sensor")
@@ -56,6 +370,11 @@ class OptimalBatteryManagementSensor(SensorEntity):
         self._max_capacity = config.get("max_capacity", 5.12)  # Default to 5.12 kWh if not specified
         self._charge_rate = config.get("charge_rate", 0.8)  # Load from config.yaml
         self._discharge_rate = config.get("discharge_rate", 0.8)  # Load from config.yaml
+        self._horizon_hours = min(max(config.get("horizon_hours", 11), 1), MAX_HORIZON_HOURS)  # Vooruitkijken, max 48 uur
+        self._forecast_cache = ForecastCache(hass.config.time_zone)
+        self._reserve_kwh = (config.get("peak_shaving") or {}).get("reserve_kwh", 0.0)  # Buffer voor peak shaving
+        self._plan_key = None  # Invoer van de laatst berekende planning
+        self.live_thresholds = []  # Per blok de live prijzen waarbij het plan verandert
         self._last_trigger = "Interval [300s]"  # Default trigger is the periodic update
         self._last_update = None  # Timestamp of the last periodic update
 
@@ -71,15 +390,19 @@ class OptimalBatteryManagementSensor(SensorEntity):
             )
             raise ValueError("Missing tariff_sensor or soc_sensor in configuration")
 
+    async def async_added_to_hass(self):
+        """Subscribe to the input sensors once the entity is added."""
+        await super().async_added_to_hass()
+
         # Volg wijzigingen in de tariff_sensor
-        async_track_state_change_event(
-            hass, self._tariff_sensor, self._handle_tariff_change_event
-        )
+        self.async_on_remove(async_track_state_change_event(
+            self.hass, self._tariff_sensor, self._handle_tariff_change_event
+        ))
 
         # Volg wijzigingen in de soc_sensor
-        async_track_state_change_event(
-            hass, self._soc_sensor, self._handle_soc_change_event
-        )
+        self.async_on_remove(async_track_state_change_event(
+            self.hass, self._soc_sensor, self._handle_soc_change_event
+        ))
 
     @property
     def name(self):
@@ -93,11 +416,6 @@ class OptimalBatteryManagementSensor(SensorEntity):
     def extra_state_attributes(self):
         return self._attributes
 
-    @property
-    def should_poll(self):
-        """Enable periodic polling."""
-        return True
-
     @property
     def scan_interval(self):
         """Set custom scan interval to 300 seconds."""
@@ -133,15 +451,16 @@ class OptimalBatteryManagementSensor(SensorEntity):
             f"Executing immediate update for sensor 'Optimal Battery Management', "
             f"triggered by {self._last_trigger}"
         )
-        self.schedule_update_ha_state(force_refresh=True)
+        # update() draait in de executor en schrijft alleen bij een gewijzigde state
+        self.hass.async_add_executor_job(self._locked_update)
 
     def update(self):
         """Update the sensor."""
-        now = datetime.now(ZoneInfo(self.hass.config.time_zone))
+        now = self._now(ZoneInfo(self.hass.config.time_zone))
 
         # Controleer of er 300 seconden zijn verstreken sinds de laatste periodieke update
         if self._last_trigger == "Interval [300s]" and self._last_update and (
-            now - self._last_update < timedelta(seconds=300)
+            self._now() - self._last_update < timedelta(seconds=300)
         ):
             _LOGGER.debug(
                 f"Skipping periodic update for sensor 'Optimal Battery Management': "
@@ -155,9 +474,10 @@ class OptimalBatteryManagementSensor(SensorEntity):
 
         # Timestamp van de laatste periodieke update bijwerken
         if self._last_trigger == "Interval [300s]":
-            self._last_update = now
+            self._last_update = self._now()
 
         # Reset last trigger to periodic interval after update
+        trigger = self._last_trigger
         self._last_trigger = "Interval [300s]"
 
         # Configurable parameters
@@ -204,25 +524,52 @@ class OptimalBatteryManagementSensor(SensorEntity):
             _LOGGER.warning("No forecast data available.")
             return
 
-        # Gebruik de Home Assistant tijdzone die al beschikbaar is
-        local_tz = ZoneInfo(self.hass.config.time_zone)
-
-        # Forecast direct omzetten naar lokale tijdzone
-        for item in forecast:
-            if isinstance(item["datetime"], str):  # Controleer of het een string is
-                item["datetime"] = datetime.fromisoformat(item["datetime"][:-1]).replace(tzinfo=ZoneInfo("UTC")).astimezone(local_tz)
-            elif isinstance(item["datetime"], datetime):  # Als het al een datetime is, zet het direct om
-                item["datetime"] = item["datetime"].astimezone(local_tz)
+        # Alleen nieuwe of gewijzigde blokken verwerken (b.v. de prijzen van morgen rond 13:00)
+        changed = self._forecast_cache.merge(forecast)
+        self._forecast_cache.prune(now)
+        for time in changed:
+            _LOGGER.debug("New forecast slot, Local Time: %s", time)
+
+        # Alleen opnieuw plannen als de horizon, de gemiddelde laadprijs of de SoC-trigger daarom vraagt
+        horizon_end = now.astimezone(timezone.utc) + timedelta(hours=self._horizon_hours)
+
+        # Horizon aanvullen met geschatte prijzen, het model leert alleen van nieuwe blokken
+        slots = self._forecast_cache.slots()
+        estimated = []
+        if self._price_model is not None:
+            if changed:
+                self._price_model.learn(slots)
+                self._price_model.save()
+            estimated = self._price_model.extend(slots, horizon_end)
+        affected = [time for time in changed if now < time + timedelta(hours=1) <= horizon_end]
+        # Ophalen van de gemiddelde laadprijs uit Home Assistant
+        avg_charge_price_sensor = self.hass.states.get("sensor.average_charge_price")
+        if not avg_charge_price_sensor or avg_charge_price_sensor.state in ["unknown", "unavailable"]:
+            avg_charge_price = 0  # Stel standaard op 0 als niet beschikbaar
+        else:
+            avg_charge_price = float(avg_charge_price_sensor.state)
+        # Kostprijs van de eerstvolgende kWh uit de accu, zodra het grootboek gevuld is
+        marginal_cost = self._ledger.marginal_cost if self._ledger is not None and self._ledger.lot_count else None
 
-        _LOGGER.debug("Converted forecast data to local timezone:")
-        for item in forecast:
-            _LOGGER.debug("Local Time: %s, Price: %.7f €/kWh", item["datetime"], item["electricity_price"] / 1e7)
+        plan_key = (
+            self._forecast_cache.window(now, horizon_end), avg_charge_price, marginal_cost,
+            estimated[-1]["datetime"] if estimated else None,
+        )
+        if not affected and plan_key == self._plan_key and trigger != "soc_sensor change":
+            _LOGGER.debug(
+                "No forecast changes within the %d hour horizon (%d changed slots), keeping current schedule.",
+                self._horizon_hours, len(changed)
+            )
+            return
+        self._plan_key = plan_key
 
         # Calculate the optimal schedule (roep function aan en kom terug om daarna het totale laad en ontlaad schema te tonen)
         optimal_schedule = calculate_optimal_schedule(
-            self.hass,  # Voeg hass toe als eerste parameter
-            forecast, current_capacity, max_capacity, charge_rate, discharge_rate,
-            self._depreciation_per_kwh, self._min_profit, self.hass.config.time_zone
+            slots + estimated, current_capacity, max_capacity, charge_rate, discharge_rate,
+            self._depreciation_per_kwh, self._min_profit, self.hass.config.time_zone,
+            horizon_hours=self._horizon_hours, reserve_kwh=self._reserve_kwh,
+            avg_charge_price=avg_charge_price, now=now, power_curve=self._power_curve,
+            marginal_cost=marginal_cost, estimate_margin=self._estimate_margin
         )
 
         # Log calculated charge and discharge schedules
@@ -240,18 +587,33 @@ class OptimalBatteryManagementSensor(SensorEntity):
                     f"Dicharge period: {time} - {time + timedelta(hours=1)}, Price: {price:.7f} €/kWh, Rate: {rate:.2f} kW"
                 )
 
+        # Drempels voor live prijzen, zodat die alleen het lopende blok hoeven te herbeslissen
+        self.live_thresholds = live_price_thresholds(
+            optimal_schedule, slots + estimated, now, self._horizon_hours,
+            avg_charge_price if marginal_cost is None else marginal_cost,
+            self._depreciation_per_kwh, self._min_profit, self._estimate_margin
+        )
+
         # Update the sensor state and attributes
         self._state = len(optimal_schedule)
         self._attributes = {"schedule": optimal_schedule}
-        self.schedule_update_ha_state()
+        if self._power_curve is not None:
+            self._attributes["power_curve"] = self._power_curve.as_dict()
+        self._publish_state()
 
 
-class OptimalChargeModeSensor(SensorEntity):
-    def __init__(self, hass, schedule_sensor):
+class OptimalChargeModeSensor(PublishOnChangeMixin, SensorEntity):
+    def __init__(self, hass, schedule_sensor, output=None):
         """Initialize the charge mode sensor."""
         self.hass = hass
         self._schedule_sensor = schedule_sensor
         self._state = "none"
+        self._output = output  # Optionele InverterOutputDriver of GridLimitController
+        self._rate = 0.0  # Gevraagd vermogen (kW) van het lopende blok
+        self._last_command = None
+        self._next_transition = None
+        self._unsub_transition = None
+        self._override = None  # (UTC blokstart, mode, rate) na een live prijs, alleen voor dat blok
 
     @property
     def name(self):
@@ -262,9 +624,8 @@ class OptimalChargeModeSensor(SensorEntity):
         return self._state
 
     @property
-    def should_poll(self):
-        """Enable periodic polling."""
-        return True
+    def extra_state_attributes(self):
+        return {"rate": self._rate}
 
     @property
     def scan_interval(self):
@@ -273,7 +634,7 @@ class OptimalChargeModeSensor(SensorEntity):
 
     def update(self):
         """Werk de sensor bij met de laatste berekende waarde."""
-        now = datetime.now(ZoneInfo(self.hass.config.time_zone))
+        now = self._now(ZoneInfo(self.hass.config.time_zone))
 
         state = self.hass.states.get(self._schedule_sensor)
         if not state or "schedule" not in state.attributes:
@@ -284,7 +645,9 @@ class OptimalChargeModeSensor(SensorEntity):
 #        schedule = self.hass.states.get(self._schedule_sensor).attributes.get("schedule", [])
         _LOGGER.debug("Update the sensor state based on the schedule.")
 
-        self._state = "none"  # Standaard state
+        mode = "none"  # Standaard state, pas aan het eind naar self._state
+        rate = 0.0
+        next_transition = None
 
         for item in schedule:
             start_time = item["time"]
@@ -295,41 +658,398 @@ class OptimalChargeModeSensor(SensorEntity):
                 except ValueError as e:
                     _LOGGER.error(f"Failed to parse schedule time: {item['time']}. Error: {e}")
                     continue
-            end_time = start_time + timedelta(hours=1)            
+            # In UTC, anders duurt het blok van 02:00 bij de overgang naar wintertijd twee uur
+            start_time = start_time.astimezone(timezone.utc)
+            end_time = start_time + timedelta(hours=1)
             _LOGGER.debug(f"Blok gevonden block ter controle {item['action']} om {start_time} <= {now} < {end_time}")
 
-            if start_time <= now < end_time:
+            # Eerstvolgende blokgrens bijhouden voor een directe update op dat moment
+            for boundary in (start_time, end_time):
+                if boundary > now and (next_transition is None or boundary < next_transition):
+                    next_transition = boundary
+
+            if start_time <= now < end_time and mode == "none":
                 current_price = item["price"]
 
                 if item["action"] == "charge":
-                    self._state = "charge"
+                    mode = "charge"
+                    rate = item.get("rate", 0.0)
                 elif item["action"] == "discharge":
-                    self._state = "discharge"
+                    mode = "discharge"
+                    rate = item.get("rate", 0.0)
+
+        # Live prijs heeft het lopende blok herbeslist
+        override = self._override
+        if override is not None:
+            override_start, override_mode, override_rate = override
+            if override_start <= now < override_start + timedelta(hours=1):
+                mode, rate = override_mode, override_rate
+            elif now >= override_start + timedelta(hours=1):
+                self._override = None
+
+        self._state = mode
+        self._rate = rate
+        _LOGGER.debug(f"State of 'Optimal Charge Mode' is now: {mode}")
+
+        if self._output is not None and (mode, rate) != self._last_command:
+            self._output.submit(mode, rate)
+            self._last_command = (mode, rate)
+
+        self._schedule_transition(next_transition)
+
+        # Alleen naar Home Assistant schrijven als de state gewijzigd is
+        self._publish_state()
+
+    def set_override(self, start, mode, rate):
+        """Replace the planned mode of the slot starting at `start` (UTC), None restores the plan."""
+        override = (start, mode, rate) if mode is not None else None
+        if override == self._override:
+            return
+        self._override = override
+        self.hass.async_add_executor_job(self._locked_update)
+
+    def _schedule_transition(self, when):
+        """Update exactly at the next slot boundary instead of waiting for the next poll."""
+        if when == self._next_transition:
+            return
+        if self._unsub_transition is not None:
+            self._unsub_transition()
+            self._unsub_transition = None
+        self._next_transition = when
+        if when is not None:
+            self._unsub_transition = track_point_in_time(self.hass, self._handle_transition, when)
 
-                break  # Stop bij de eerste match
+    def _handle_transition(self, now):
+        """Handle a slot boundary."""
+        self._unsub_transition = None
+        self._next_transition = None
+        self._locked_update()
 
-        _LOGGER.debug(f"State of 'Optimal Charge Mode' is now: {self._state}")
 
-        # **BELANGRIJK**: Forceer een update in Home Assistant
-        self.schedule_update_ha_state()
+class PeakShavingSensor(PublishOnChangeMixin, SensorEntity):
+    """Battery discharge power needed to keep the quarter-hour grid import under the target.
+
+    Every grid power event is evaluated, but the state is only written when
+    shaving starts or stops and otherwise every 10 seconds. The running
+    averages go to hass.data instead of into the attributes.
+    """
+
+    def __init__(self, hass, config, soc_sensor, discharge_rate, tolerance=0.0, power_sensor=None):
+        """Initialiseer de sensor."""
+        self.hass = hass
+        self._tolerance = tolerance
+        self._max_power_w = discharge_rate * 1000  # Meer dan de ontlaadsnelheid kan de accu niet leveren
+        self._grid_power_sensor = config.get("grid_power_sensor")  # W, positief is afname
+        self._power_sensor = power_sensor  # Accuvermogen in W, positief is ontladen
+        self._soc_sensor = soc_sensor
+        self._target_w = config.get("target_kw", 2.5) * 1000
+        self._window = SlidingWindowAverage()
+        self._demand = QuarterHourDemand(hass.config.time_zone)
+        self._last_timestamp = 0.0
+        self._state = 0.0
+        self._attributes = {}
+
+    @property
+    def name(self):
+        return "Peak Shaving Power"
+
+    @property
+    def state(self):
+        return round(self._state, 2)
+
+    @property
+    def unit_of_measurement(self):
+        return "kW"
+
+    @property
+    def extra_state_attributes(self):
+        return self._attributes
+
+    @property
+    def scan_interval(self):
+        """Publiceren en herberekenen, ook als er geen vermogensmeting binnenkomt."""
+        return timedelta(seconds=10)
+
+    async def async_added_to_hass(self):
+        """Subscribe to the grid power sensor."""
+        await super().async_added_to_hass()
+        self.async_on_remove(async_track_state_change_event(
+            self.hass, self._grid_power_sensor, self._handle_power_event
+        ))
+
+    @callback
+    def _handle_power_event(self, event):
+        """Evaluate every power event directly in the event loop, without writing state."""
+        new_state = event.data.get("new_state")
+        if new_state is None:
+            return
+        try:
+            import_w = float(new_state.state)
+        except ValueError:
+            return
+        self._evaluate(new_state.last_updated.timestamp(), import_w)
+
+    async def _async_scheduled_update(self, now):
+        state = self.hass.states.get(self._grid_power_sensor)
+        try:
+            import_w = float(state.state)
+        except (AttributeError, ValueError):
+            return
+        self._evaluate(now.timestamp(), import_w, publish=True)
+
+    def _evaluate(self, timestamp, import_w, publish=False):
+        timestamp = max(timestamp, self._last_timestamp)  # Timer en events niet in omgekeerde volgorde verwerken
+        self._last_timestamp = timestamp
+        self._window.add(timestamp, import_w)
+        self._demand.add(timestamp, import_w)
+
+        # De afname is al verlaagd met wat de accu nu ontlaadt, dat telt niet als ruimte
+        battery_w = 0.0
+        battery = self.hass.states.get(self._power_sensor) if self._power_sensor else None
+        try:
+            if battery is not None:
+                battery_w = float(battery.state)
+        except ValueError:
+            pass
+        required_w = min(self._demand.required_discharge(self._target_w, battery_w), self._max_power_w)
+
+        # Lege accu kan niet afvlakken
+        soc = self.hass.states.get(self._soc_sensor)
+        try:
+            if soc is not None and float(soc.state) <= 0:
+                required_w = 0.0
+        except ValueError:
+            pass
+
+        shaving = self._state > 0
+        self._state = required_w / 1000
+        if not publish and (self._state > 0) == shaving:
+            return  # Begin en einde van het afvlakken direct, de rest op de timer
+
+        # Lopende gemiddelden veranderen bij elke meting, die alleen in hass.data
+        self.hass.data[f"{DOMAIN}_peak_shaving_stats"] = {
+            "average_15min_kw": round(self._window.average() / 1000, 2),
+            "interval_average_kw": round(self._demand.interval_average() / 1000, 2),
+        }
+        self._attributes = {
+            "month_peak_kw": round(self._demand.month_peak / 1000, 2),
+            "target_kw": round(self._target_w / 1000, 2),
+        }
+        self._publish_state()
+
+    def update(self):
+        """Updates komen uit power events, zie _handle_power_event."""
+
+
+class GridLimitSensor(PublishOnChangeMixin, SensorEntity):
+    """Battery setpoint after the grid limit controller.
+
+    The loop latency, jitter and counters change on every sample, so they go
+    to hass.data like the publish counters instead of into the attributes.
+    """
+
+    def __init__(self, hass, grid_power_sensor, controller):
+        """Initialiseer de sensor."""
+        self.hass = hass
+        self._grid_power_sensor = grid_power_sensor  # W, positief is afname
+        self._controller = controller
+        self._state = 0.0
+        self._attributes = {}
+
+    @property
+    def name(self):
+        return "Grid Limit Setpoint"
+
+    @property
+    def state(self):
+        return self._state
+
+    @property
+    def unit_of_measurement(self):
+        return "kW"
+
+    @property
+    def extra_state_attributes(self):
+        return self._attributes
+
+    @property
+    def scan_interval(self):
+        """Het regelen gebeurt per event, de state hoeft maar af en toe naar HA."""
+        return timedelta(seconds=10)
+
+    async def async_added_to_hass(self):
+        """Subscribe to the grid power sensor."""
+        await super().async_added_to_hass()
+        self.async_on_remove(async_track_state_change_event(
+            self.hass, self._grid_power_sensor, self._handle_power_event
+        ))
+
+    @callback
+    def _handle_power_event(self, event):
+        """Feed every grid power event directly to the controller, without writing state."""
+        new_state = event.data.get("new_state")
+        if new_state is None:
+            return
+        try:
+            grid_w = float(new_state.state)
+        except ValueError:
+            return
+        self._controller.update(new_state.last_updated.timestamp(), grid_w, self._now().timestamp())
+
+    async def _async_scheduled_update(self, now):
+        self.update()
+
+    def update(self):
+        """Publiceer het huidige setpoint, de statistieken van de regellus alleen in hass.data."""
+        self._state = round(self._controller.setpoint_w / 1000, 2)
+        self._attributes = self._controller.as_dict()
+        self.hass.data[f"{DOMAIN}_grid_limit_stats"] = self._controller.stats()
+        self._publish_state()
+
+
+class LivePriceSensor(PublishOnChangeMixin, SensorEntity):
+    """Latest live intraday/imbalance price, re-deciding the current slot when it crosses the plan thresholds."""
+
+    def __init__(self, hass, config, schedule_sensor, charge_mode_sensor):
+        """Initialiseer de sensor."""
+        self.hass = hass
+        self._config = config["live_prices"]
+        self._schedule_sensor = schedule_sensor
+        self._charge_mode_sensor = charge_mode_sensor
+        self._soc_sensor = config.get("soc_sensor")
+        self._max_capacity = config.get("max_capacity", 5.12)
+        self._rates = {"charge": config.get("charge_rate", 0.8), "discharge": config.get("discharge_rate", 0.8)}
+        self._reserve_kwh = (config.get("peak_shaving") or {}).get("reserve_kwh", 0.0)
+        self._client = None
+        self._decision = None  # (blokstart, mode) van de laatste herbeslissing
+        self.redecisions = 0
+        self._state = None
+        self._attributes = {}
+
+    @property
+    def name(self):
+        return "Live Electricity Price"
+
+    @property
+    def state(self):
+        return self._state
+
+    @property
+    def unit_of_measurement(self):
+        return "€/kWh"
+
+    @property
+    def extra_state_attributes(self):
+        return self._attributes
+
+    @property
+    def scan_interval(self):
+        """Statistieken van de stream bijwerken als er geen prijzen binnenkomen."""
+        return timedelta(seconds=60)
+
+    async def async_added_to_hass(self):
+        """Connect to the price feed."""
+        await super().async_added_to_hass()
+        session = None
+        if not self._config["url"].startswith("tcp://"):
+            from homeassistant.helpers.aiohttp_client import async_get_clientsession
+            session = async_get_clientsession(self.hass)
+        try:
+            self._client = PriceStreamClient(
+                self._config["url"], self._handle_price,
+                queue_size=self._config.get("queue_size", 64),
+                retry_delay=self._config.get("retry_delay", 5.0),
+                session=session,
+            )
+        except ValueError as e:
+            _LOGGER.error(f"Invalid live_prices configuration: {e}")
+            return
+        await self._client.async_start()
+        self.async_on_remove(lambda: self.hass.async_create_task(self._client.async_stop()))
+
+    async def _async_scheduled_update(self, now):
+        self._publish()
+
+    def _current_thresholds(self, now):
+        for thresholds in self._schedule_sensor.live_thresholds:
+            if thresholds["start"] <= now < thresholds["start"] + timedelta(hours=1):
+                return thresholds
+        return None
+
+    def _handle_price(self, timestamp, price):
+        """Re-decide the current slot for the newest live price (event loop, once per batch)."""
+        self._state = round(price, 5)
+        now = datetime.fromtimestamp(timestamp, timezone.utc)
+        thresholds = self._current_thresholds(now)
+        if thresholds is not None:
+            soc = self.hass.states.get(self._soc_sensor)
+            try:
+                current_capacity = self._max_capacity * float(soc.state) / 100.0
+            except (AttributeError, ValueError):
+                current_capacity = None
+            if current_capacity is not None:
+                mode = redecide_slot(thresholds, price, current_capacity, self._max_capacity, self._reserve_kwh)
+                decision = (thresholds["start"], mode)
+                if decision != self._decision:
+                    self._decision = decision
+                    if mode == thresholds["action"]:
+                        self._charge_mode_sensor.set_override(thresholds["start"], None, 0.0)
+                    else:
+                        self.redecisions += 1
+                        _LOGGER.info(
+                            f"Live price {price:.4f} €/kWh changes the slot at {thresholds['start']} "
+                            f"from {thresholds['action']} to {mode}"
+                        )
+                        self._charge_mode_sensor.set_override(thresholds["start"], mode, self._rates.get(mode, 0.0))
+        self._publish(now, thresholds)
+
+    def _publish(self, now=None, thresholds=None):
+        if self._client is None:
+            return
+        now = now or self._now()
+        slot = self._client.overlay.slot(now.timestamp() - now.timestamp() % 3600)
+        # Tellers van de stream veranderen bij elke prijs, die alleen in hass.data
+        self.hass.data[f"{DOMAIN}_live_price_stats"] = {
+            **self._client.as_dict(),
+            "slot_prices": slot["count"] if slot else 0,
+            "redecisions": self.redecisions,
+        }
+        self._attributes = {
+            "slot_min": slot["min"] if slot else None,
+            "slot_max": slot["max"] if slot else None,
+            "thresholds": {
+                "action": thresholds["action"],
+                "day_ahead_price": thresholds["price"],
+                "charge_below": round(thresholds["charge_below"], 4),
+                "discharge_above": round(thresholds["discharge_above"], 4),
+            } if thresholds else None,
+            "decision": self._decision[1] if self._decision else None,
+        }
+        self._publish_state()
+
+    def update(self):
+        """Prijzen komen uit de stream, zie _handle_price."""
 
 
-class AvgChargePriceSensor(SensorEntity):
+class AvgChargePriceSensor(EnergyIntegratorMixin, PublishOnChangeMixin, SensorEntity):
     """Sensor om de gemiddelde laadprijs te berekenen en bij te houden."""
     
-    def __init__(self, hass, power_sensor, tariff_sensor, soc_sensor, max_capacity):
+    def __init__(self, hass, power_sensor, tariff_sensor, soc_sensor, max_capacity, tolerance=0.0, statistics=None, ledger=None):
         """Initialiseer de sensor."""
         self.hass = hass
+        self._tolerance = tolerance  # Minimale wijziging voordat de state opnieuw geschreven wordt
+        self._statistics = statistics  # Optionele HourlyEnergyStatistics voor lange termijn statistieken
+        self._ledger = ledger if ledger is not None else CostBasisLedger()  # Geladen lots, FIFO ontladen
         self._power_sensor = power_sensor
         self._tariff_sensor = tariff_sensor
         self._soc_sensor = soc_sensor
         self._max_capacity = max_capacity
         self._state = 0.0  # Standaardwaarde
+        self._attributes = {}
         
-        # Startwaarden
-        #self.calculated_energy = soc_percentage * self._max_capacity
-        self.calculated_energy = 5.12  # kWh
-        self.total_cost_energy = 1.00  # EUR
+        # Startwaarde voor energie die al in de accu zit: 1.00 EUR per 5.12 kWh
+        self._initial_price = 1.00 / 5.12  # €/kWh
+        self._seeded = False
         self._last_update = None  # Tijdstempel van laatste update
         self._previous_power = 0  # Houd vorige vermogen bij om transities te detecteren
 
@@ -342,13 +1062,12 @@ class AvgChargePriceSensor(SensorEntity):
         return round(float(self._state), 4) if isinstance(self._state, (int, float)) else self._state
 
     @property
-    def unit_of_measurement(self):
-        return "€/kWh"
+    def extra_state_attributes(self):
+        return self._attributes
 
     @property
-    def should_poll(self):
-        """Periodieke updates inschakelen."""
-        return True
+    def unit_of_measurement(self):
+        return "€/kWh"
 
     @property
     def scan_interval(self):
@@ -357,7 +1076,7 @@ class AvgChargePriceSensor(SensorEntity):
 
     def update(self):
         """Werk de sensor bij met de laatste energie- en kostenberekening."""
-        now = datetime.now()
+        now = self._now()  # UTC, lokale tijd springt bij zomer-/wintertijd
         
         # Voorkom updates binnen 58 seconden
         if self._last_update and (now - self._last_update).total_seconds() < 58:
@@ -392,41 +1111,46 @@ class AvgChargePriceSensor(SensorEntity):
         
         _LOGGER.debug(f"Power Sensor: {power_value} W, Tariff: {tariff_value} €/kWh, SoC: {soc_percentage:.2f}")
         
-        if self._previous_power <= 0 and power_value > 0:
-            self.total_cost_energy = self.total_cost_energy * ((soc_percentage * self._max_capacity) / (self.calculated_energy + 0.00001))
-            self.calculated_energy = soc_percentage * self._max_capacity
-            _LOGGER.debug(f"Updated calculated_energy: {self.calculated_energy:.4f} kWh based on SoC.")
-            _LOGGER.debug(f"Updated total_cost_energy: {self.total_cost_energy:.4f} EUR to keep avg cost consistent.")
+        stored_energy = soc_percentage * self._max_capacity
+        if not self._seeded:
+            # Energie die al in de accu zit krijgt de startprijs
+            self._ledger.sync(stored_energy, self._initial_price)
+            self._seeded = True
+        elif self._previous_power <= 0 < power_value or self._previous_power >= 0 > power_value:
+            # Begin van (ont)laden: grootboek gelijkzetten met de SoC (verliezen, gemiste metingen)
+            self._ledger.sync(stored_energy, self._ledger.average_cost or self._initial_price)
+            _LOGGER.debug(f"Synced ledger to {stored_energy:.4f} kWh based on SoC.")
         
-        if power_value < 0:  # Alleen bij laden (negatieve waarde)
-            charged_energy = (power_value * -1) / (60 * 1000)  # kWh per minuut
-            cost_for_energy = tariff_value * charged_energy  # Kosten voor geladen energie
-            
-            self.calculated_energy += charged_energy
-            self.total_cost_energy += cost_for_energy
+        charged_energy, discharged_energy, cost_for_energy, revenue = self._energy_and_cost_since_last(
+            power_value, now, tariff_value
+        )
+        if charged_energy > 0:  # Laden (negatief vermogen)
+            self._ledger.charge(charged_energy, cost_for_energy / charged_energy)
+            if self._statistics is not None:
+                self._statistics.add_charge(now, charged_energy, cost_for_energy)
 
             _LOGGER.debug(f"Charged Energy: {charged_energy:.6f} kWh, Cost: {cost_for_energy:.6f} EUR")
-            _LOGGER.debug(f"Current Calculated Energy: {self.calculated_energy:.6f} kWh")
-            _LOGGER.debug(f"Current Total Cost Energy: {self.total_cost_energy:.6f} EUR")
+        if discharged_energy > 0:  # Ontladen: oudste lots eerst afboeken
+            profit = self._ledger.discharge(discharged_energy, revenue / discharged_energy)
+            _LOGGER.debug(f"Discharged Energy: {discharged_energy:.6f} kWh, Profit: {profit:.6f} EUR")
 
+        self._state = self._ledger.average_cost
+        self._attributes = self._ledger.as_dict()
         
-        if self.calculated_energy > 0:
-            self._state = self.total_cost_energy / self.calculated_energy
-        else:
-            self._state = 0.0
-        
-        _LOGGER.debug(f"Updated Average Charge Price: {self._state:.6f} €/kWh")
+        _LOGGER.debug(f"Updated Average Charge Price: {self._state:.6f} €/kWh, ledger: {self._attributes}")
         
         self._previous_power = power_value
-        self.schedule_update_ha_state()
+        self._publish_state()
 
 #-----
-class AvgDisChargePriceSensor(SensorEntity):
+class AvgDisChargePriceSensor(EnergyIntegratorMixin, PublishOnChangeMixin, SensorEntity):
     """Sensor om de gemiddelde ontlaadprijs te berekenen en bij te houden."""
     
-    def __init__(self, hass, power_sensor, tariff_sensor, soc_sensor, max_capacity):
+    def __init__(self, hass, power_sensor, tariff_sensor, soc_sensor, max_capacity, tolerance=0.0, statistics=None):
         """Initialiseer de sensor."""
         self.hass = hass
+        self._tolerance = tolerance  # Minimale wijziging voordat de state opnieuw geschreven wordt
+        self._statistics = statistics  # Optionele HourlyEnergyStatistics voor lange termijn statistieken
         self._power_sensor = power_sensor
         self._tariff_sensor = tariff_sensor
         self._soc_sensor = soc_sensor
@@ -452,11 +1176,6 @@ class AvgDisChargePriceSensor(SensorEntity):
     def unit_of_measurement(self):
         return "€/kWh"
 
-    @property
-    def should_poll(self):
-        """Periodieke updates inschakelen."""
-        return True
-
     @property
     def scan_interval(self):
         """Bepaal hoe vaak de sensor zichzelf update (elke minuut)."""
@@ -464,7 +1183,7 @@ class AvgDisChargePriceSensor(SensorEntity):
 
     def update(self):
         """Werk de sensor bij met de laatste energie- en kostenberekening."""
-        now = datetime.now()
+        now = self._now()
         
         # Voorkom updates binnen 58 seconden
         if self._last_update and (now - self._last_update).total_seconds() < 58:
@@ -505,12 +1224,13 @@ class AvgDisChargePriceSensor(SensorEntity):
             _LOGGER.debug(f"Updated calculated_energy: {self.calculated_energy:.4f} kWh based on SoC.")
             _LOGGER.debug(f"Updated total_revenue_energy: {self.total_revenue_energy:.4f} EUR to keep avg revenue consistent.")
         
-        if power_value > 0:  # Alleen bij ontladen (positieve waarde)
-            discharged_energy = (power_value * 1) / (60 * 1000)  # kWh per minuut
-            revenue_for_energy = tariff_value * discharged_energy  # Kosten voor geladen energie
+        _, discharged_energy, _, revenue_for_energy = self._energy_and_cost_since_last(power_value, now, tariff_value)
+        if discharged_energy > 0:  # Alleen bij ontladen (positief vermogen)
             
             self.calculated_energy += discharged_energy
             self.total_revenue_energy += revenue_for_energy
+            if self._statistics is not None:
+                self._statistics.add_discharge(now, discharged_energy, revenue_for_energy)
 
             _LOGGER.debug(f"DisCharged Energy: {discharged_energy:.6f} kWh, Cost: {revenue_for_energy:.6f} EUR")
             _LOGGER.debug(f"Current Calculated Energy: {self.calculated_energy:.6f} kWh")
@@ -525,17 +1245,20 @@ class AvgDisChargePriceSensor(SensorEntity):
         _LOGGER.debug(f"Updated Average DisCharge Price: {self._state:.6f} €/kWh")
         
         self._previous_power = power_value
-        self.schedule_update_ha_state()
+        self._publish_state()
 
 #-----
 
 
-class ChargingEfficiencySensor(SensorEntity):
+class ChargingEfficiencySensor(EnergyIntegratorMixin, PowerCurveLearnerMixin, PublishOnChangeMixin, SensorEntity):
     """Sensor om de efficiëntie van het laden te berekenen."""
 
-    def __init__(self, hass, power_sensor, soc_sensor, max_capacity):
+    def __init__(self, hass, power_sensor, soc_sensor, max_capacity, tolerance=0.0, power_curve=None, grid_controller=None):
         """Initialiseer de sensor."""
         self.hass = hass
+        self._tolerance = tolerance  # Minimale wijziging voordat de state opnieuw geschreven wordt
+        self._power_curve = power_curve  # Optionele PowerCurve die uit de metingen leert
+        self._grid_controller = grid_controller  # Optionele GridLimitController, niet leren tijdens begrenzen
         self._power_sensor = power_sensor
         self._soc_sensor = soc_sensor
         self._max_capacity = max_capacity
@@ -558,11 +1281,6 @@ class ChargingEfficiencySensor(SensorEntity):
     def unit_of_measurement(self):
         return "%"
 
-    @property
-    def should_poll(self):
-        """Periodieke updates inschakelen."""
-        return True
-
     @property
     def scan_interval(self):
         """Bepaal hoe vaak de sensor zichzelf update (elke minuut)."""
@@ -570,7 +1288,7 @@ class ChargingEfficiencySensor(SensorEntity):
 
     def update(self):
         """Werk de sensor bij met de laatste laad- en efficiëntieberekening."""
-        now = datetime.now()
+        now = self._now()
 
         # Voorkom updates binnen 58 seconden
         if self._last_update and (now - self._last_update).total_seconds() < 58:
@@ -604,12 +1322,14 @@ class ChargingEfficiencySensor(SensorEntity):
             self._capaciteit_laden = 0.0
             _LOGGER.debug(f"Nieuwe laadcyclus gestart. Start SOC: {self._start_soc * 100:.2f}%")
 
-        # **Accumuleren van de geladen energie per minuut**
-        if power_value < 0:
-            geladen_kwh = abs(power_value) / 1000 / 60  # kWh per minuut
+        # **Accumuleren van de geladen energie sinds de vorige update**
+        geladen_kwh, _ = self._energy_since_last(power_value, now)
+        if geladen_kwh > 0:
             self._capaciteit_laden += geladen_kwh
             _LOGGER.debug(f"Charge Power: {power_value} W, SoC: {current_soc * 100:.2f}%")
             _LOGGER.debug(f"Laadcapaciteit verhoogd met {geladen_kwh:.6f} kWh. Totale laadcapaciteit: {self._capaciteit_laden:.6f} kWh.")
+        if power_value < 0:
+            self._learn_power_curve("charge", current_soc, power_value)
 
         # **Efficiëntieberekening bij SOC-wijziging**
         if self._start_soc is not None and current_soc > self._start_soc:
@@ -634,18 +1354,21 @@ class ChargingEfficiencySensor(SensorEntity):
         # **Opslaan van het laatste vermogen om overgang te detecteren**
         self._last_power = power_value
         self._last_soc = current_soc
-        # **Update Home Assistant**
-        self.schedule_update_ha_state()
+        # **Update Home Assistant (alleen bij wijziging)**
+        self._publish_state()
 
 
 
 
-class DisChargingEfficiencySensor(SensorEntity):
+class DisChargingEfficiencySensor(EnergyIntegratorMixin, PowerCurveLearnerMixin, PublishOnChangeMixin, SensorEntity):
     """Sensor om de efficiëntie van het ontladen te berekenen."""
 
-    def __init__(self, hass, power_sensor, soc_sensor, max_capacity):
+    def __init__(self, hass, power_sensor, soc_sensor, max_capacity, tolerance=0.0, power_curve=None, grid_controller=None):
         """Initialiseer de sensor."""
         self.hass = hass
+        self._tolerance = tolerance  # Minimale wijziging voordat de state opnieuw geschreven wordt
+        self._power_curve = power_curve  # Optionele PowerCurve die uit de metingen leert
+        self._grid_controller = grid_controller  # Optionele GridLimitController, niet leren tijdens begrenzen
         self._power_sensor = power_sensor
         self._soc_sensor = soc_sensor
         self._max_capacity = max_capacity
@@ -668,11 +1391,6 @@ class DisChargingEfficiencySensor(SensorEntity):
     def unit_of_measurement(self):
         return "%"
 
-    @property
-    def should_poll(self):
-        """Periodieke updates inschakelen."""
-        return True
-
     @property
     def scan_interval(self):
         """Bepaal hoe vaak de sensor zichzelf update (elke minuut)."""
@@ -680,7 +1398,7 @@ class DisChargingEfficiencySensor(SensorEntity):
 
     def update(self):
         """Werk de sensor bij met de laatste ontlaad- en efficiëntieberekening."""
-        now = datetime.now()
+        now = self._now()
 
         # Voorkom updates binnen 58 seconden
         if self._last_update and (now - self._last_update).total_seconds() < 59:
@@ -713,11 +1431,13 @@ class DisChargingEfficiencySensor(SensorEntity):
             self._capaciteit_ontladen = 0.0
             _LOGGER.debug(f"Nieuwe ontlaadcyclus gestart. Start SOC: {self._start_soc * 100:.2f}%")
 
-        # **Accumuleren van de ontladen energie per minuut**
-        if power_value > 0:
-            ontladen_kwh = power_value / 1000 / 60  # kWh per minuut
+        # **Accumuleren van de ontladen energie sinds de vorige update**
+        _, ontladen_kwh = self._energy_since_last(power_value, now)
+        if ontladen_kwh > 0:
             self._capaciteit_ontladen += ontladen_kwh
             _LOGGER.debug(f"Ontlaadcapaciteit verhoogd met {ontladen_kwh:.6f} kWh. Totale ontlaadcapaciteit: {self._capaciteit_ontladen:.6f} kWh.")
+        if power_value > 0:
+            self._learn_power_curve("discharge", current_soc, power_value)
             
 
         # **Efficiëntieberekening bij SOC-wijziging**
@@ -742,215 +1462,7 @@ class DisChargingEfficiencySensor(SensorEntity):
 
         self._last_power = power_value
         self._last_soc = current_soc
-        self.schedule_update_ha_state()
-
-def calculate_optimal_schedule(hass, forecast, current_capacity, max_capacity, charge_rate, discharge_rate, depreciation_per_kwh, min_profit, time_zone):
-    """Calculate optimal charge and discharge schedule based on forecast."""
-    _LOGGER.info("Starting calculation of optimal schedule.")
-
-    now = datetime.now(ZoneInfo(time_zone))  # Gebruik de doorgegeven tijdzone
-
-    # Log current time for debugging
-    _LOGGER.info(f"Home Assistant timezone: {time_zone}")
-    #_LOGGER.debug(f"Current local time: {datetime.now(ZoneInfo(time_zone))}")
-    _LOGGER.info(f"Current now time: {now}")
-    
-    # Calculate required charge capacity
-    remaining_charge_capacity = max_capacity - current_capacity
-    available_discharge_capacity = current_capacity
-
-    # Filter future forecast data
-    future_forecast = []
-    hours_ahead = now + timedelta(hours=11)  # Define the cutoff time
-    
-    for item in forecast:
-        forecast_time = item["datetime"]
-        if isinstance(forecast_time, str):
-            forecast_time = datetime.fromisoformat(forecast_time).replace(tzinfo=ZoneInfo("UTC"))
-
-        block_time = forecast_time + timedelta(hours=1)
-
-        if now < block_time <= hours_ahead:     # niet te ver vooruit anders nu als tijden voor morgen (4 tijden eerste 10 uur
-            future_forecast.append(item)
-            _LOGGER.debug("Forecast_time: %s till block_time %s added", forecast_time, block_time )
-        else:
-            _LOGGER.debug("NO Forecast_time for: %s till block_time %s", forecast_time, block_time)
-            if block_time > hours_ahead:
-                break  # Alle volgende blokken liggen buiten de 10-uursgrens, dus stoppen
-
-    if not future_forecast:
-        _LOGGER.warning("No valid forecast data available for the future!")
-        return []
-
-    # Sort by cheapest and most expensive periods
-    cheapest_periods = sorted(future_forecast, key=lambda x: x["electricity_price"])[:3]
-    most_expensive_periods = sorted(future_forecast, key=lambda x: -x["electricity_price"])[:3]
-    most_expensive_period = sorted(future_forecast, key=lambda x: -x["electricity_price"])[:1]
-    average_peak_price = sum(item["electricity_price"] / 1e7 for item in most_expensive_periods) / len(most_expensive_periods)
-
-    _LOGGER.debug("Cheapest periods: %s", cheapest_periods)
-    _LOGGER.debug("Most expensive periods: %s", most_expensive_periods)
-    _LOGGER.debug("Most expensive period: %s", most_expensive_period)
-    _LOGGER.debug("AVG expensive periods: %.3f €/kWh", average_peak_price)
-
-    # Calculate charge schedule
-    charge_schedule = []
-    
-    #hier zou je later de actuele waarde kunnen vullen soc*totaal
-    total_charge_capacity = 0
-    
-    seen_charge_times = set()  # bewaakt unieke (tijd, "charge") entries
-
-    # Charge schedule zonder beperkingen
-    for item in cheapest_periods:
-        if isinstance(item["datetime"], str):
-            time = datetime.fromisoformat(item["datetime"])
-        else:
-            time = item["datetime"]
-
-        price = item["electricity_price"] / 1e7
-
-        key = (time, "charge")
-        if key in seen_charge_times:
-            continue
-        seen_charge_times.add(key)
-
-        charge_schedule.append({
-            "time": time,
-            "price": price,
-            "action": "charge",
-            "rate": charge_rate
-        })
-
-    
-        _LOGGER.debug(
-            "Adding charge period at %s: Price %.2f €/kWh.",
-            time, price
-        )
-
-
-    # Filter forecastdata van nu tot aan de duurste piekperiode
-    pre_peak_forecast = []
-
-    # Haal de tijd van het duurste blok op
-    most_expensive_time = most_expensive_period[0]["datetime"]
-    if isinstance(most_expensive_time, str):
-        most_expensive_time = datetime.fromisoformat(most_expensive_time).replace(tzinfo=ZoneInfo("UTC"))
-
-    for item in forecast:
-        forecast_time = item["datetime"]
-        if isinstance(forecast_time, str):
-            forecast_time = datetime.fromisoformat(forecast_time).replace(tzinfo=ZoneInfo("UTC"))
-
-        block_time = forecast_time + timedelta(hours=1)
-
-        # Alleen blokken opnemen die eindigen vóór de piek
-        if now < block_time <= most_expensive_time:
-            pre_peak_forecast.append(item)
-            _LOGGER.debug("PRE-PEAK Forecast_time: %s till block_time %s added", forecast_time, block_time)
-        else:
-            _LOGGER.debug("NO PRE-PEAK Forecast_time for: %s till block_time %s", forecast_time, block_time)
-            if block_time > most_expensive_time:
-                break  # Alle volgende blokken liggen ook na de piek, dus stoppen
-
-    if not pre_peak_forecast:
-        _LOGGER.warning("No valid pre-peak forecast data available!")
-    else:
-        _LOGGER.debug("pre_peak_forecast: %s", pre_peak_forecast)
-        cheapest_pre_peak_periods = sorted(pre_peak_forecast, key=lambda x: x["electricity_price"])[:3]
-        _LOGGER.debug("Pre_peak_periods: %s", cheapest_pre_peak_periods)
-
-        # Extra pre-peak charge momenten (optioneel toevoegen als ze voldoen aan de prijsvoorwaarde)
-
-        for item in cheapest_pre_peak_periods:
-            if isinstance(item["datetime"], str):
-                time = datetime.fromisoformat(item["datetime"])
-            else:
-                time = item["datetime"]
-
-            price = item["electricity_price"] / 1e7  # Omzetten naar €/kWh
-
-            # Voorwaarde: alleen toevoegen als prijs lager is dan piek - marge
-            if price < (average_peak_price - (depreciation_per_kwh + min_profit)):
-                key = (time, "charge")
-                if key in seen_charge_times:
-                    continue
-                seen_charge_times.add(key)
-
-                charge_schedule.append({
-                    "time": time,
-                    "price": price,
-                    "action": "charge",
-                    "rate": charge_rate
-                })
-
-                _LOGGER.debug(
-                    "Adding PRE-PEAK charge period at %s: Price %.3f €/kWh (threshold: %.3f)",
-                    time, price, average_peak_price - (depreciation_per_kwh + min_profit)
-                )
-            else:
-                _LOGGER.debug(
-                    "Skipping PRE-PEAK charge period at %s: Price %.3f €/kWh is above threshold %.3f",
-                    time, price, average_peak_price - (depreciation_per_kwh + min_profit)
-                )
-
-    # Calculate discharge schedule
-    discharge_schedule = []
-    total_discharge_capacity = 0
-
-    # Ophalen van de gemiddelde laadprijs uit Home Assistant
-    avg_charge_price_sensor = hass.states.get("sensor.average_charge_price")
-    if not avg_charge_price_sensor or avg_charge_price_sensor.state in ["unknown", "unavailable"]:
-        avg_charge_price = 0  # Stel standaard op 0 als niet beschikbaar
-    else:
-        avg_charge_price = float(avg_charge_price_sensor.state)
-        
-
-    # Bepaal de drempelwaarde (kostprijs van laden + afschrijving + minimale winst)
-    cost_threshold = avg_charge_price + depreciation_per_kwh + min_profit
-    _LOGGER.info(
-        "Calculated cost Threshold: %.3f €/kWh <= average charge (%.3f) + depreciation (%.3f) + min_profit (%.3f).",
-        cost_threshold, avg_charge_price, depreciation_per_kwh, min_profit
-    )
-
-    # Discharge schedule met controle op afschrijving en minimale winst
-    discharge_schedule = []
-    for item in most_expensive_periods:
-        if isinstance(item["datetime"], str):
-            time = datetime.fromisoformat(item["datetime"])
-        else:
-            time = item["datetime"]
-
-        price = item["electricity_price"] / 1e7  # Prijs omzetten naar €/kWh
-
-        # Controle: Alleen ontladen als de prijs hoger is dan de kostprijs
-        if price > cost_threshold:
-            discharge_schedule.append({
-                "time": time, 
-                "price": price, 
-                "action": "discharge", 
-                "rate": discharge_rate
-            })
-
-            _LOGGER.debug(
-                "Adding discharge period at %s: Price %.2f €/kWh (Threshold: %.2f €/kWh).",
-                time, price, cost_threshold
-            )
-        else:
-            _LOGGER.debug(
-                "Skipping discharge period at %s: Price %.2f €/kWh is below threshold %.2f €/kWh.",
-                time, price, cost_threshold
-            )
-
-    _LOGGER.debug("Calculated charge schedule: %s", charge_schedule)
-    _LOGGER.debug("Calculated discharge schedule: %s", discharge_schedule)
-
-    # Combine schedules
-    full_schedule = charge_schedule + discharge_schedule
-    full_schedule = sorted(full_schedule, key=lambda x: x["time"])
-    _LOGGER.info("Final optimal schedule: %s", full_schedule)
-
-    return full_schedule
+        self._publish_state()
 
 class Accu1ChargeModeSensor(SensorEntity):
     def __init__(self, hass):
@@ -0,0 +1,284 @@
+"""Run the sensors for days of synthetic inputs on a virtual clock.
+
+Run with: python -m custom_components.optimal_battery_management.simulate --start 2026-10-20 --days 7
+
+Prices follow a daily and weekly profile and are published as a day-ahead
+forecast at 13:00 local time. A battery model follows the charge mode,
+so SoC and power react to the schedule. Afterwards the charge-mode
+transitions and accumulated energy and costs are checked; the exit code is
+1 when a check fails. Recorded inputs can be run with replay.py, which uses
+the same virtual clock.
+"""
+import argparse
+import json
+import logging
+import random
+import time
+from datetime import datetime, timedelta, timezone
+from zoneinfo import ZoneInfo
+
+from .capture import KIND_POWER, KIND_SOC, KIND_TARIFF
+from .energy_statistics import HourlyEnergyStatistics
+from .replay import InputReplay
+
+_LOGGER = logging.getLogger(__name__)
+
+STEP = 60  # Seconden per simulatiestap, gelijk aan de meetfrequentie van de sensoren
+
+
+def synthetic_price(local_time, rng):
+    """Day-ahead price (€/kWh) with a morning and evening peak, cheap midday and weekend."""
+    hour = local_time.hour
+    price = 0.22
+    if 7 <= hour < 9:
+        price += 0.08
+    elif 11 <= hour < 15:
+        price -= 0.07  # Zon
+    elif 17 <= hour < 21:
+        price += 0.12
+    elif hour < 6:
+        price -= 0.03
+    if local_time.weekday() >= 5:
+        price -= 0.02
+    return round(price + rng.uniform(-0.02, 0.02), 4)
+
+
+class BatteryModel:
+    """Battery that follows the submitted charge mode, like InverterOutputDriver.submit()."""
+
+    def __init__(self, max_capacity, soc, efficiency=0.95, taper_soc=0.9, charge_power=0.8):
+        self.max_capacity = max_capacity
+        self.energy = max_capacity * soc / 100.0
+        self.efficiency = efficiency  # Per richting
+        self.taper_soc = taper_soc  # Boven deze SoC daalt het laadvermogen lineair
+        self.charge_power = charge_power  # kW dat de accu kan laden onder taper_soc
+        self.mode = "none"
+        self.rate = 0.0
+        self.commands = 0
+
+    def submit(self, mode, rate_kw):
+        self.mode = mode
+        self.rate = rate_kw
+        self.commands += 1
+
+    @property
+    def soc(self):
+        return 100.0 * self.energy / self.max_capacity
+
+    def step(self, seconds):
+        """Advance the battery and return the AC power in W (negative is charging)."""
+        hours = seconds / 3600
+        if self.mode == "charge":
+            soc = self.energy / self.max_capacity
+            capability = self.charge_power
+            if soc > self.taper_soc:
+                capability *= max((1 - soc) / (1 - self.taper_soc), 0.05)
+            power = min(self.rate, capability)  # Het commando is een maximum, de BMS begrenst de rest
+            power = min(power, (self.max_capacity - self.energy) / self.efficiency / hours)
+            self.energy += power * hours * self.efficiency
+            return -power * 1000
+        if self.mode == "discharge":
+            power = min(self.rate, self.energy * self.efficiency / hours)
+            self.energy -= power * hours / self.efficiency
+            return power * 1000
+        return 0.0
+
+
+class Simulation(InputReplay):
+    """InputReplay driven by synthetic prices and a battery model instead of a capture file."""
+
+    def __init__(self, config, time_zone="Europe/Amsterdam", soc=50.0, seed=1):
+        self.battery = BatteryModel(config.get("max_capacity", 5.12), soc, charge_power=config.get("charge_rate", 0.8))
+        super().__init__(
+            config, time_zone, HourlyEnergyStatistics(config.get("depreciation_per_kwh", 0.065)), output=self.battery
+        )
+        self._local_tz = ZoneInfo(time_zone)
+        self._rng = random.Random(seed)
+        self._prices = {}  # UTC uurstart -> €/kWh
+        self._schedule_changed = None
+        self.mismatches = []  # (tijdstip, verwachte mode, charge mode)
+        self.hourly_tariffs = {}  # lokale datum -> aantal tariefwijzigingen
+        self.charged_energy = 0.0  # kWh AC, zoals gemeten door de power sensor
+        self.discharged_energy = 0.0
+        self.simulated_seconds = 0
+
+    def _publish_day(self, day):
+        """Publish the prices of a local calendar day (23, 24 or 25 hours) as forecast."""
+        start = datetime(day.year, day.month, day.day, tzinfo=self._local_tz).astimezone(timezone.utc)
+        end = datetime.combine(day + timedelta(days=1), datetime.min.time(), self._local_tz).astimezone(timezone.utc)
+        hour = start
+        while hour < end:
+            self._prices[hour] = synthetic_price(hour.astimezone(self._local_tz), self._rng)
+            hour += timedelta(hours=1)
+
+        now = self.clock.now()
+        forecast = [
+            {"datetime": hour.strftime("%Y-%m-%dT%H:%M:%S.000000Z"), "electricity_price": int(price * 1e7)}
+            for hour, price in sorted(self._prices.items())
+            if hour + timedelta(hours=1) > now
+        ]
+        tariff = self.hass.states.get(self._entity_ids[KIND_TARIFF])
+        self.hass.states.set(self._entity_ids[KIND_TARIFF], tariff.state if tariff else "unknown", {"forecast": forecast})
+        self._trigger("tariff_sensor change")
+
+    def _state_writer(self, entity_id, entity):
+        write = super()._state_writer(entity_id, entity)
+        if entity is not self.schedule_sensor:
+            return write
+
+        def _write(force_refresh=False):
+            self._schedule_changed = self.clock.now()
+            write(force_refresh)
+        return _write
+
+    def _expected_mode(self, now):
+        """Charge mode according to the published schedule, with slot arithmetic in UTC."""
+        schedule = self.schedule_sensor.extra_state_attributes.get("schedule", [])
+        for period in schedule:
+            start = period["time"].astimezone(timezone.utc)
+            if start <= now < start + timedelta(hours=1):
+                return period["action"]
+        return "none"
+
+    def run_days(self, start, days):
+        """Simulate `days` days from local midnight of `start`."""
+        local_start = datetime(start.year, start.month, start.day, tzinfo=self._local_tz)
+        now = local_start.astimezone(timezone.utc)
+        end = datetime.combine(start + timedelta(days=days), datetime.min.time(), self._local_tz).astimezone(timezone.utc)
+        self.clock.set(now)
+
+        soc_sensor = self._entity_ids[KIND_SOC]
+        power_sensor = self._entity_ids[KIND_POWER]
+        self.hass.states.set(soc_sensor, str(round(self.battery.soc)))
+        self.hass.states.set(power_sensor, "0.0")
+        self._publish_day(local_start.date())
+        last_soc = round(self.battery.soc)
+
+        while now < end:
+            local = now.astimezone(self._local_tz)
+            if now.minute == 0 and now.second == 0:
+                price = self._prices.get(now)
+                if price is not None:
+                    previous = self.hass.states.get(self._entity_ids[KIND_TARIFF])
+                    self.hass.states.set(self._entity_ids[KIND_TARIFF], repr(price), previous.attributes if previous else {})
+                    self.hourly_tariffs[str(local.date())] = self.hourly_tariffs.get(str(local.date()), 0) + 1
+                    self._trigger("tariff_sensor change")
+                if local.hour == 13:
+                    self._publish_day(local.date() + timedelta(days=1))
+
+            self.advance(now)
+
+            expected = self._expected_mode(now)
+            actual = self.charge_mode_sensor.state
+            settled = self._schedule_changed is None or now - self._schedule_changed >= timedelta(seconds=STEP)
+            if expected != actual and settled:
+                self.mismatches.append((now, expected, actual))
+
+            power_w = self.battery.step(STEP)
+            if power_w < 0:
+                self.charged_energy += -power_w * STEP / 3600000
+            else:
+                self.discharged_energy += power_w * STEP / 3600000
+            self.hass.states.set(power_sensor, repr(power_w))
+            self.events += 1
+
+            now += timedelta(seconds=STEP)
+            self.simulated_seconds += STEP
+            self.clock.set(now)
+            soc = round(self.battery.soc)
+            if soc != last_soc:
+                last_soc = soc
+                self.hass.states.set(soc_sensor, str(soc))
+                self._trigger("soc_sensor change")
+
+        self.advance(end)
+
+    def check(self, start, days):
+        """Return a list of failed checks."""
+        failures = []
+        local_tz = self._local_tz
+
+        for (previous, _), (when, mode) in zip(self.transitions, self.transitions[1:]):
+            if when < previous:
+                failures.append(f"Transition to {mode} at {when.isoformat()} is before {previous.isoformat()}")
+        for when, expected, actual in self.mismatches[:5]:
+            failures.append(f"At {when.isoformat()} the schedule says {expected} but the charge mode is {actual}")
+
+        # Aantal uren per lokale dag, 23 of 25 bij de overgang naar zomer- of wintertijd
+        for offset in range(days):
+            day = start + timedelta(days=offset)
+            hours = int((
+                datetime.combine(day + timedelta(days=1), datetime.min.time(), local_tz).astimezone(timezone.utc)
+                - datetime.combine(day, datetime.min.time(), local_tz).astimezone(timezone.utc)
+            ).total_seconds() // 3600)
+            if self.hourly_tariffs.get(str(day), 0) != hours:
+                failures.append(f"{day} had {self.hourly_tariffs.get(str(day), 0)} tariff updates, expected {hours}")
+
+        # Uurtotalen moeten optellen tot de gemeten energie (één meting per minuut)
+        closed = self.statistics.take_closed(self.clock.now() + timedelta(hours=1))
+        for key, truth in (("charged_energy", self.charged_energy), ("discharged_energy", self.discharged_energy)):
+            total = sum(bucket[key] for _, bucket in closed)
+            if abs(total - truth) > 0.01 + 0.001 * truth:
+                failures.append(f"Hourly {key} adds up to {total:.3f} kWh, the battery saw {truth:.3f} kWh")
+
+        ledger = self.ledger.as_dict()
+        if abs(ledger["stored_energy"] - self.battery.energy) > 0.1 * self.battery.max_capacity:
+            failures.append(
+                f"Ledger holds {ledger['stored_energy']:.3f} kWh, the battery {self.battery.energy:.3f} kWh"
+            )
+        if ledger["lots"] > self.ledger._max_lots:
+            failures.append(f"Ledger has {ledger['lots']} lots, more than {self.ledger._max_lots}")
+
+        prices = list(self._prices.values()) + [self.entities["sensor.average_charge_price"]._initial_price]
+        average = self.entities["sensor.average_charge_price"].state
+        if ledger["stored_energy"] > 0.01 and not min(prices) - 1e-6 <= average <= max(prices) + 1e-6:
+            failures.append(f"Average charge price {average} is outside the tariff range")
+        return failures
+
+    def summary(self):
+        summary = super().summary()
+        summary.update({
+            "simulated_hours": round(self.simulated_seconds / 3600, 2),
+            "battery_soc": round(self.battery.soc, 2),
+            "charged_energy": round(self.charged_energy, 3),
+            "discharged_energy": round(self.discharged_energy, 3),
+            "inverter_commands": self.battery.commands,
+            "mismatch_minutes": len(self.mismatches),
+        })
+        return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Simulate Optimal Battery Management on a virtual clock")
+    parser.add_argument("--config", help="JSON file with the integration configuration")
+    parser.add_argument("--start", default="2026-10-20", help="first local day (YYYY-MM-DD)")
+    parser.add_argument("--days", type=int, default=7)
+    parser.add_argument("--time-zone", default="Europe/Amsterdam")
+    parser.add_argument("--soc", type=float, default=50.0, help="initial SoC in %%")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--log-level", default="ERROR")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=args.log_level)
+    config = {"tariff_sensor": "sensor.tariff", "soc_sensor": "sensor.soc", "power_sensor": "sensor.power"}
+    if args.config:
+        with open(args.config, encoding="utf-8") as file:
+            config.update(json.load(file))
+
+    start = datetime.strptime(args.start, "%Y-%m-%d").date()
+    simulation = Simulation(config, args.time_zone, args.soc, args.seed)
+    started = time.perf_counter()
+    simulation.run_days(start, args.days)
+    elapsed = time.perf_counter() - started
+
+    failures = simulation.check(start, args.days)
+    summary = simulation.summary()
+    summary["seconds"] = round(elapsed, 3)
+    summary["speedup"] = round(simulation.simulated_seconds / elapsed) if elapsed else None
+    summary["failures"] = failures
+    print(json.dumps(summary, indent=2, default=str))
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
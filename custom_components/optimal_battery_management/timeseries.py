@@ -0,0 +1,294 @@
+"""Bounded in-memory history of the input sensors at several resolutions."""
+import math
+import threading
+from array import array
+
+# (resolutie in seconden, aantal punten): een dag per minuut, een maand per kwartier
+TIERS = ((60, 1440), (900, 2976))
+RAW_CAPACITY = 3600  # Ruwe metingen, een uur bij één meting per seconde
+
+
+class _Ring:
+    """Fixed-size ring of (timestamp, value) in two float arrays, oldest first."""
+
+    def __init__(self, capacity):
+        self._capacity = capacity
+        self._times = array("d", bytes(8 * capacity))
+        self._values = array("d", bytes(8 * capacity))
+        self._start = 0
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    @property
+    def capacity(self):
+        return self._capacity
+
+    def append(self, timestamp, value):
+        if self._size < self._capacity:
+            index = (self._start + self._size) % self._capacity
+            self._size += 1
+        else:
+            index = self._start  # Oudste punt overschrijven
+            self._start = (self._start + 1) % self._capacity
+        self._times[index] = timestamp
+        self._values[index] = value
+
+    def time(self, position):
+        return self._times[(self._start + position) % self._capacity]
+
+    def value(self, position):
+        return self._values[(self._start + position) % self._capacity]
+
+    def bisect_right(self, timestamp):
+        """Position of the first point after `timestamp`, O(log n)."""
+        low, high = 0, self._size
+        while low < high:
+            middle = (low + high) // 2
+            if timestamp < self.time(middle):
+                high = middle
+            else:
+                low = middle + 1
+        return low
+
+
+def _clamp(value, lower, upper):
+    if lower is not None and value < lower:
+        return lower
+    if upper is not None and value > upper:
+        return upper
+    return value
+
+
+class TimeSeries:
+    """Raw samples plus time-weighted averages per minute and per quarter hour.
+
+    A sample holds until the next one, like a Home Assistant state. A NaN
+    sample marks a gap (unknown/unavailable): gaps integrate to zero, a
+    bucket without data becomes a gap and a partly covered bucket holds the
+    average of its covered part, placed from its first value on, with gaps
+    around it. Appending is O(1) (amortised over the buckets it closes);
+    range queries use a binary search and take each part from the finest
+    tier that has it.
+    """
+
+    def __init__(self, raw_capacity=RAW_CAPACITY, tiers=TIERS):
+        self._raw = _Ring(raw_capacity)
+        self._tiers = [(width, _Ring(capacity)) for width, capacity in tiers]
+        self._bucket = [None] * len(tiers)  # Open bucket per tier
+        self._area = [0.0] * len(tiers)  # Waarde·seconden in de open bucket
+        self._covered = [0.0] * len(tiers)  # Seconden met een waarde in de open bucket
+        self._first = [None] * len(tiers)  # Eerste tijdstip met een waarde in de open bucket
+        self._last = None
+
+    def add(self, timestamp, value):
+        if self._last is not None:
+            last_time, last_value = self._last
+            if timestamp < last_time:
+                return  # Niet in volgorde, negeren
+            self._accumulate(last_time, timestamp, last_value)
+        self._raw.append(timestamp, value)
+        self._last = (timestamp, value)
+
+    def _accumulate(self, start, end, value):
+        for index, (width, ring) in enumerate(self._tiers):
+            position = start
+            if self._bucket[index] is None:
+                self._bucket[index] = int(position // width)
+            while position < end:
+                key = int(position // width)
+                if key != self._bucket[index]:
+                    bucket_start = self._bucket[index] * width
+                    first = self._first[index]
+                    if first is None:
+                        if len(ring) and not math.isnan(ring.value(len(ring) - 1)):
+                            ring.append(bucket_start, math.nan)  # Begin van een gat
+                    else:
+                        # Deels een gat: NaN tot de eerste waarde, het gemiddelde over de gedekte tijd, dan weer NaN
+                        if first > bucket_start and len(ring) and not math.isnan(ring.value(len(ring) - 1)):
+                            ring.append(bucket_start, math.nan)
+                        ring.append(first, self._area[index] / self._covered[index])
+                        if first + self._covered[index] < bucket_start + width:
+                            ring.append(first + self._covered[index], math.nan)
+                    self._area[index] = self._covered[index] = 0.0
+                    self._first[index] = None
+                    self._bucket[index] = key
+                    if end - position > width * (ring.capacity + 1):
+                        # Lange stilte: alleen de buckets die nog in de ring passen vullen
+                        position = (int(end // width) - ring.capacity) * width
+                        self._bucket[index] = key = int(position // width)
+                bucket_end = min(end, (key + 1) * width)
+                if value == value:  # Gaten (NaN) tellen niet mee in het gemiddelde
+                    if self._first[index] is None:
+                        self._first[index] = position
+                    self._area[index] += value * (bucket_end - position)
+                    self._covered[index] += bucket_end - position
+                position = bucket_end
+
+    @property
+    def first_time(self):
+        """Oldest timestamp still available in any tier."""
+        times = [ring.time(0) for _, ring in self._tiers if len(ring)]
+        if len(self._raw):
+            times.append(self._raw.time(0))
+        return min(times) if times else None
+
+    def _source(self, start):
+        """Finest ring that covers `start`, with the bucket width (None for raw)."""
+        if len(self._raw) and self._raw.time(0) <= start:
+            return self._raw, None
+        for width, ring in self._tiers:
+            if len(ring) and ring.time(0) <= start:
+                return ring, width
+        return self._raw, None
+
+    def segments(self, start, end):
+        """Yield (from, to, value) over [start, end], NaN for gaps.
+
+        Each part comes from the finest tier that has it: quarter-hour
+        buckets until the minute buckets start, those until the raw samples.
+        """
+        sources = [self._raw] + [ring for _, ring in self._tiers]  # Fijn naar grof
+        position = start
+        for index in range(len(sources) - 1, -1, -1):
+            ring = sources[index]
+            if not len(ring) or position >= end:
+                continue
+            # Alleen het deel dat geen fijnere tier heeft
+            until = min([end] + [finer.time(0) for finer in sources[:index] if len(finer)])
+            if until > position:
+                yield from self._ring_segments(ring, position, until)
+                position = until
+
+    @staticmethod
+    def _ring_segments(ring, start, end):
+        if end <= start or not len(ring):
+            return
+        position = max(ring.bisect_right(start) - 1, 0)
+        size = len(ring)
+        while position < size:
+            segment_start = max(ring.time(position), start)
+            segment_end = ring.time(position + 1) if position + 1 < size else end
+            segment_end = min(segment_end, end)
+            if segment_end > segment_start:
+                yield segment_start, segment_end, ring.value(position)
+            if segment_end >= end:
+                break
+            position += 1
+
+    def integrate(self, start, end, lower=None, upper=None):
+        """Time integral (value·s) over [start, end], values clamped to [lower, upper], gaps as zero.
+
+        Older than the raw samples the clamp applies to the bucket averages,
+        so charge and discharge within one bucket cancel out.
+        """
+        return sum(
+            _clamp(value, lower, upper) * (segment_end - segment_start)
+            for segment_start, segment_end, value in self.segments(start, end)
+            if value == value
+        )
+
+    def mean(self, start, end):
+        """Time-weighted average over [start, end], gaps excluded (None without data)."""
+        total = covered = 0.0
+        for segment_start, segment_end, value in self.segments(start, end):
+            if value == value:
+                total += value * (segment_end - segment_start)
+                covered += segment_end - segment_start
+        return total / covered if covered else None
+
+    def points(self, start, end):
+        """[(timestamp, value)] between start and end from the finest tier covering `start`."""
+        ring, _ = self._source(start)
+        position = ring.bisect_right(start)
+        if position > 0 and (position == len(ring) or ring.time(position) > start):
+            position -= 1  # Waarde die op `start` nog geldt
+        result = []
+        while position < len(ring) and ring.time(position) <= end:
+            result.append((ring.time(position), ring.value(position)))
+            position += 1
+        return result
+
+
+class TimeSeriesStore:
+    """TimeSeries per entity, shared by the sensors; writes from the event loop, reads from executor threads."""
+
+    def __init__(self, raw_capacity=RAW_CAPACITY):
+        self._raw_capacity = raw_capacity
+        self._lock = threading.Lock()
+        self._series = {}
+
+    def add(self, entity_id, timestamp, value):
+        with self._lock:
+            series = self._series.get(entity_id)
+            if series is None:
+                series = self._series[entity_id] = TimeSeries(self._raw_capacity)
+            series.add(timestamp, value)
+
+    def add_state(self, entity_id, timestamp, state):
+        """Add a state string, non-numeric states (unknown, unavailable) are stored as a gap."""
+        try:
+            value = float(state)
+        except (TypeError, ValueError):
+            value = math.nan
+        self.add(entity_id, timestamp, value)
+
+    def covers(self, entity_id, timestamp):
+        with self._lock:
+            series = self._series.get(entity_id)
+            first_time = series.first_time if series is not None else None
+        return first_time is not None and first_time <= timestamp
+
+    def integrate(self, entity_id, start, end, lower=None, upper=None):
+        with self._lock:
+            series = self._series.get(entity_id)
+            return series.integrate(start, end, lower, upper) if series is not None else 0.0
+
+    def integrate_product(self, entity_id, weight_id, start, end, lower=None, upper=None, default=None):
+        """Integral of value × weight (e.g. power × tariff) over [start, end].
+
+        Values are clamped to [lower, upper] and gaps count as zero. Where the
+        weight series has no data or a gap, `default` is used (zero if None).
+        """
+        with self._lock:
+            series = self._series.get(entity_id)
+            if series is None:
+                return 0.0
+            weight_series = self._series.get(weight_id)
+            values = list(series.segments(start, end))
+            weights = list(weight_series.segments(start, end)) if weight_series is not None else []
+
+        fallback = default if default is not None else 0.0
+        total = 0.0
+        index = 0
+        for segment_start, segment_end, value in values:
+            if value != value:
+                continue
+            value = _clamp(value, lower, upper)
+            position = segment_start
+            while position < segment_end:
+                # Gewicht dat op `position` geldt, vóór de eerste meting de fallback
+                while index < len(weights) and weights[index][1] <= position:
+                    index += 1
+                if index < len(weights) and weights[index][0] <= position:
+                    until = min(segment_end, weights[index][1])
+                    weight = weights[index][2]
+                    if weight != weight:
+                        weight = fallback
+                else:
+                    until = min(segment_end, weights[index][0]) if index < len(weights) else segment_end
+                    weight = fallback
+                total += value * weight * (until - position)
+                position = until
+        return total
+
+    def mean(self, entity_id, start, end):
+        with self._lock:
+            series = self._series.get(entity_id)
+            return series.mean(start, end) if series is not None else None
+
+    def points(self, entity_id, start, end):
+        with self._lock:
+            series = self._series.get(entity_id)
+            return series.points(start, end) if series is not None else []
@@ -0,0 +1,45 @@
+"""InputRecorder rotation: a new capture file starts with the last known inputs."""
+from custom_components.optimal_battery_management.capture import (
+    KIND_FORECAST,
+    KIND_FORECAST_SLOT,
+    KIND_POWER,
+    KIND_SOC,
+    KIND_TARIFF,
+    RECORD,
+    InputRecorder,
+)
+
+FORECAST = [
+    {"datetime": "2026-10-19T10:00:00.000Z", "electricity_price": 2500000},
+    {"datetime": "2026-10-19T11:00:00.000Z", "electricity_price": 3100000},
+]
+
+
+def _records(path):
+    with open(path, "rb") as file:
+        return list(RECORD.iter_unpack(file.read()))
+
+
+def test_rotated_file_starts_with_the_last_inputs(tmp_path):
+    path = str(tmp_path / "capture.bin")
+    recorder = InputRecorder(path, max_bytes=RECORD.size * 8, backups=1)
+    recorder.record_state(100.0, KIND_TARIFF, "0.25")
+    recorder.record_forecast(100.0, FORECAST)
+    recorder.record_state(101.0, KIND_SOC, "55")
+    recorder.record_state(102.0, KIND_POWER, "-800")
+    recorder.flush()
+    recorder.record_state(200.0, KIND_POWER, "500")
+    recorder.record_state(201.0, KIND_POWER, "400")
+    recorder.record_state(202.0, KIND_SOC, "54")
+    recorder.flush()
+
+    records = _records(path)
+    head = [(timestamp, kind, value) for timestamp, kind, _aux, value in records[:3]]
+    # Kop met de stand na het vorige bestand, op het tijdstip van de eerste nieuwe record
+    assert head == [(200.0, KIND_TARIFF, 0.25), (200.0, KIND_SOC, 55.0), (200.0, KIND_POWER, -800.0)]
+    assert records[3][1:3] == (KIND_FORECAST, 2)
+    assert [record[1] for record in records[4:6]] == [KIND_FORECAST_SLOT, KIND_FORECAST_SLOT]
+    assert [record[3] for record in records[4:6]] == [2500000.0, 3100000.0]
+    assert [(kind, value) for _timestamp, kind, _aux, value in records[6:]] == [
+        (KIND_POWER, 500.0), (KIND_POWER, 400.0), (KIND_SOC, 54.0)
+    ]
@@ -0,0 +1,34 @@
+"""Hourly statistics buckets, including the partial hour written on shutdown."""
+from datetime import datetime, timezone
+
+from custom_components.optimal_battery_management.energy_statistics import HourlyEnergyStatistics
+
+
+def _at(hour, minute):
+    return datetime(2026, 10, 19, hour, minute, tzinfo=timezone.utc)
+
+
+def test_open_hour_waits_until_it_is_finished():
+    statistics = HourlyEnergyStatistics(0.065)
+    statistics.add_charge(_at(10, 5), 1.0, 0.2)
+    assert statistics.take_closed(_at(10, 50)) == []
+    ((hour, bucket),) = statistics.take_closed(_at(11, 1))
+    assert hour == _at(10, 0)
+    assert bucket["charged_energy"] == 1.0
+
+
+def test_force_closes_the_partial_hour():
+    statistics = HourlyEnergyStatistics(0.065)
+    statistics.add_charge(_at(10, 5), 1.0, 0.2)
+    statistics.add_charge(_at(10, 40), 0.5, 0.1)
+    ((hour, bucket),) = statistics.take_closed(_at(10, 50), force=True)
+    assert hour == _at(10, 0)
+    assert bucket["charged_energy"] == 1.5
+    assert abs(bucket["charge_cost"] - 0.3) < 1e-9
+
+    # De rest van hetzelfde uur komt in een nieuwe bucket voor dat uur
+    statistics.add_discharge(_at(10, 55), 0.2, 0.08)
+    ((hour, bucket),) = statistics.take_closed(_at(11, 1))
+    assert hour == _at(10, 0)
+    assert bucket["charged_energy"] == 0.0
+    assert bucket["discharged_energy"] == 0.2
@@ -0,0 +1,50 @@
+"""GridLimitController with an inverter that follows the setpoint one sample late."""
+from custom_components.optimal_battery_management.grid_control import GridLimitController
+
+
+class _Output:
+    def __init__(self):
+        self.commands = []
+
+    def submit(self, mode, rate_kw):
+        self.commands.append((mode, rate_kw))
+
+
+def _run(controller, mode, rate_kw, household_w, samples=100):
+    """Return the grid power per sample, the battery applies the previous setpoint."""
+    controller.update(0, household_w)
+    controller.submit(mode, rate_kw)
+    sign = 1 if mode == "charge" else -1
+    applied = 0.0
+    grid = []
+    for timestamp in range(1, samples):
+        grid_w = household_w + sign * applied
+        controller.update(timestamp, grid_w)
+        grid.append(grid_w)
+        applied = controller.setpoint_w
+    return grid
+
+
+def test_import_limit_is_not_left_within_the_deadband():
+    controller = GridLimitController(_Output(), import_limit_kw=5.0, deadband_kw=0.05)
+    grid = _run(controller, "charge", 3.0, 4000.0)
+    assert max(grid[-10:]) <= 5000.0 + 1e-6
+    assert controller.limiting
+
+
+def test_zero_export_is_not_left_within_the_deadband():
+    controller = GridLimitController(_Output(), zero_export=True, deadband_kw=0.05)
+    grid = _run(controller, "discharge", 2.0, 1500.0)
+    assert min(grid[-10:]) >= -1e-6
+
+
+def test_deadband_holds_back_small_increases():
+    output = _Output()
+    controller = GridLimitController(output, import_limit_kw=5.0, deadband_kw=0.05)
+    controller.submit("charge", 3.0)
+    controller.update(0, 7000.0)  # 2 kW over de limiet
+    written = len(output.commands)
+    controller.update(1, 4980.0)  # 20 W onder de limiet, minder dan de deadband
+    assert len(output.commands) == written
+    controller.update(2, 4500.0)
+    assert len(output.commands) == written + 1
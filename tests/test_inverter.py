@@ -0,0 +1,94 @@
+"""InverterOutputDriver against the local Modbus TCP simulator."""
+import asyncio
+import types
+
+from custom_components.optimal_battery_management.inverter import InverterOutputDriver
+from custom_components.optimal_battery_management.modbus_sim import ModbusTcpSimulator
+
+
+async def _wait_for(condition, timeout=3.0):
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while not condition():
+        assert loop.time() < deadline, "timed out"
+        await asyncio.sleep(0.01)
+
+
+async def _with_driver(test, simulator=None, **config):
+    """Run `test(driver, simulator)` with a driver connected to a fresh simulator."""
+    simulator = simulator or ModbusTcpSimulator(port=0)
+    await simulator.start()
+    hass = types.SimpleNamespace(loop=asyncio.get_running_loop())
+    driver = InverterOutputDriver(hass, {
+        "host": "127.0.0.1", "port": simulator.port, "mode_register": 40, "power_register": 41,
+        "min_write_interval": 0.0, "retry_delay": 0.05, **config,
+    })
+    await driver.async_start()
+    try:
+        await test(driver, simulator)
+    finally:
+        await driver.async_stop()
+        await simulator.stop()
+
+
+def test_adjacent_registers_are_written_in_one_request_and_verified():
+    async def test(driver, simulator):
+        driver.submit("charge", 1.5)
+        await _wait_for(lambda: driver._written == ("charge", 1.5))
+        assert simulator.writes == [(40, [1, 1500])]
+        assert driver.verify_failures == 0
+
+    asyncio.run(_with_driver(test))
+
+
+def test_pending_commands_are_coalesced_and_rate_limited():
+    async def test(driver, simulator):
+        loop = asyncio.get_running_loop()
+        driver.submit("charge", 1.0)
+        await _wait_for(lambda: driver._written == ("charge", 1.0))
+        written_at = loop.time()
+        for rate in (0.2, 0.4, 0.6):
+            driver.submit("discharge", rate)
+        await _wait_for(lambda: driver._written == ("discharge", 0.6))
+        assert loop.time() - written_at >= 0.25
+        # Alleen het nieuwste commando binnen het interval wordt geschreven
+        assert simulator.writes == [(40, [1, 1000]), (40, [2, 600])]
+        assert driver.write_count == 2
+
+    asyncio.run(_with_driver(test, min_write_interval=0.3))
+
+
+def test_distant_registers_are_read_back_per_run():
+    async def test(driver, simulator):
+        driver.submit("discharge", 0.8)
+        await _wait_for(lambda: driver._written == ("discharge", 0.8))
+        assert simulator.registers[100] == 2
+        assert simulator.registers[300] == 800
+        assert driver.verify_failures == 0
+        assert driver.write_count == 1
+
+    asyncio.run(_with_driver(test, mode_register=100, power_register=300))
+
+
+def test_failed_read_back_is_retried():
+    class FlakySimulator(ModbusTcpSimulator):
+        """Drops the first power register write, like an inverter that was still busy."""
+
+        dropped = False
+
+        def _handle_pdu(self, pdu):
+            response = super()._handle_pdu(pdu)
+            if pdu[0] == 0x10 and not self.dropped:
+                self.dropped = True
+                self.registers[41] = 0
+            return response
+
+    async def test(driver, simulator):
+        driver.submit("charge", 2.0)
+        await _wait_for(lambda: driver._written == ("charge", 2.0))
+        assert driver.verify_failures == 1
+        assert driver.write_count == 2
+        assert simulator.registers[40:42] == [1, 2000]
+
+    asyncio.run(_with_driver(test, FlakySimulator(port=0)))
+
@@ -0,0 +1,134 @@
+"""Live price stream against the local simulator, and re-deciding a slot."""
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+from custom_components.optimal_battery_management.live_prices import PriceStreamClient
+from custom_components.optimal_battery_management.optimizer import (
+    calculate_optimal_schedule,
+    live_price_thresholds,
+    redecide_slot,
+)
+from custom_components.optimal_battery_management.price_stream_sim import PriceStreamSimulator
+
+NOW = datetime(2026, 10, 19, 10, 30, tzinfo=timezone.utc)
+PRICES = [0.22, 0.18, 0.15, 0.16, 0.20, 0.28, 0.35, 0.40, 0.38, 0.30, 0.25, 0.22]
+
+
+def _forecast():
+    start = NOW.replace(minute=0)
+    return [
+        {
+            "datetime": (start + timedelta(hours=index)).strftime("%Y-%m-%dT%H:%M:%S.000000Z"),
+            "electricity_price": int(price * 1e7),
+        }
+        for index, price in enumerate(PRICES)
+    ]
+
+
+def _thresholds(action="none", price=0.25):
+    return {
+        "start": NOW.replace(minute=0), "action": action, "price": price, "rate": 0.8,
+        "charge_below": 0.15, "discharge_above": 0.35,
+    }
+
+
+async def _stream(prices, queue_size, handle):
+    """Send `prices` as one burst and return the client after the last one is handled."""
+    simulator = PriceStreamSimulator(port=0, interval=3600)  # Alleen de prijzen van de test
+    await simulator.start()
+    client = PriceStreamClient(f"tcp://127.0.0.1:{simulator.port}", handle, queue_size=queue_size, retry_delay=0.1)
+    await client.async_start()
+    try:
+        for _ in range(200):
+            if simulator._clients:
+                break
+            await asyncio.sleep(0.01)
+        start = NOW.timestamp()
+        for index, price in enumerate(prices):
+            simulator.send(price, datetime.fromtimestamp(start + index, timezone.utc))
+        for _ in range(200):
+            if client.overlay.latest is not None and client.overlay.latest[1] == prices[-1]:
+                break
+            await asyncio.sleep(0.01)
+    finally:
+        await client.async_stop()
+        await simulator.stop()
+    return client
+
+
+def test_burst_is_bounded_by_the_queue_and_coalesced():
+    updates = []
+    prices = [round(0.20 + index / 1000, 4) for index in range(500)]
+    client = asyncio.run(_stream(prices, 4, lambda timestamp, price: updates.append(price)))
+
+    assert client.received == 500
+    assert client.max_queue_depth <= 4
+    assert client.coalesced > 0
+    assert len(updates) + client.coalesced == 500
+    assert updates[-1] == prices[-1]
+    assert client.overlay.slot(NOW.replace(minute=0).timestamp())["count"] == 500
+
+
+def test_invalid_lines_do_not_stop_the_stream():
+    async def run():
+        simulator = PriceStreamSimulator(port=0, interval=3600)
+        await simulator.start()
+        updates = []
+        client = PriceStreamClient(f"tcp://127.0.0.1:{simulator.port}", lambda t, p: updates.append(p))
+        await client.async_start()
+        try:
+            while not simulator._clients:
+                await asyncio.sleep(0.01)
+            for writer in simulator._clients:
+                writer.write(b"not json\n")
+            simulator.send(0.31, NOW)
+            while not updates:
+                await asyncio.sleep(0.01)
+        finally:
+            await client.async_stop()
+            await simulator.stop()
+        return client, updates
+
+    client, updates = asyncio.run(asyncio.wait_for(run(), 5))
+    assert client.invalid == 1
+    assert updates == [0.31]
+
+
+def test_spike_from_the_stream_redecides_the_slot():
+    decisions = []
+    thresholds = _thresholds()
+    asyncio.run(_stream(
+        [0.25, 0.26, 0.80], 64,
+        lambda timestamp, price: decisions.append(redecide_slot(thresholds, price, 2.0, 5.12)),
+    ))
+    assert decisions[-1] == "discharge"
+
+
+def test_redecide_slot():
+    idle = _thresholds()
+    assert redecide_slot(idle, 0.25, 2.0, 5.12) == "none"
+    assert redecide_slot(idle, 0.50, 2.0, 5.12) == "discharge"
+    assert redecide_slot(idle, 0.50, 2.0, 5.12, reserve_kwh=2.0) == "none"  # Reserve blijft staan
+    assert redecide_slot(idle, 0.05, 2.0, 5.12) == "charge"
+    assert redecide_slot(idle, 0.05, 5.12, 5.12) == "none"  # Accu is vol
+
+    charge = _thresholds("charge", 0.12)
+    assert redecide_slot(charge, 0.12, 2.0, 5.12) == "charge"
+    assert redecide_slot(charge, 0.20, 2.0, 5.12) == "none"
+
+    discharge = _thresholds("discharge", 0.40)
+    assert redecide_slot(discharge, 0.40, 2.0, 5.12) == "discharge"
+    assert redecide_slot(discharge, 0.30, 2.0, 5.12) == "none"
+
+
+def test_day_ahead_price_keeps_the_plan():
+    forecast = _forecast()
+    schedule = calculate_optimal_schedule(
+        forecast, 2.0, 5.12, 0.8, 0.8, 0.065, 0.05, "Europe/Amsterdam",
+        horizon_hours=12, avg_charge_price=0.15, now=NOW,
+    )
+    thresholds = live_price_thresholds(schedule, forecast, NOW, 12, 0.15, 0.065, 0.05)
+
+    assert thresholds
+    for slot in thresholds:
+        assert redecide_slot(slot, slot["price"], 2.0, 5.12) == slot["action"]
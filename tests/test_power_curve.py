@@ -0,0 +1,73 @@
+"""PowerCurve learning, also while the schedule commands the curve's own limits."""
+from datetime import datetime, timedelta, timezone
+
+from custom_components.optimal_battery_management.optimizer import apply_power_curve
+from custom_components.optimal_battery_management.power_curve import PowerCurve
+
+MAX_CAPACITY = 5.12
+START = datetime(2026, 10, 19, 0, 0, tzinfo=timezone.utc)
+
+
+def _battery_charge_kw(soc, commanded_kw):
+    """Battery of 1 kW that only tapers above 90% SoC, the command is a maximum."""
+    return min(commanded_kw, max((1 - soc) / 0.1, 0.05) if soc > 0.9 else 1.0)
+
+
+def test_full_rate_sample_is_learned():
+    curve = PowerCurve(1.0, 1.0)
+    assert curve.add_sample(0.5, -600, commanded_kw=1.0)
+    assert curve.charge[10] < 1.0
+
+
+def test_sample_at_a_limited_command_is_skipped():
+    curve = PowerCurve(1.0, 0.8)
+    # Ontladen ingekort voor de peak shaving reserve, de accu volgt het commando
+    assert not curve.add_sample(0.27, 321, commanded_kw=0.32)
+    assert curve.discharge[5] == 0.8
+    # Laden begrensd door de curve zelf
+    assert not curve.add_sample(0.82, -840, commanded_kw=0.84)
+    assert curve.charge[16] == 1.0
+
+
+def test_sample_clearly_below_a_limited_command_is_learned():
+    curve = PowerCurve(1.0, 1.0)
+    assert curve.add_sample(0.97, -250, commanded_kw=0.75)
+    assert curve.charge[19] < 1.0
+
+
+def _charge_slots(start, first, count=5):
+    return [
+        {"time": start + timedelta(hours=hour), "price": 0.1, "action": "charge", "rate": 1.0}
+        for hour in range(first, count)
+    ]
+
+
+def test_scheduling_with_the_curve_does_not_feed_back_into_it():
+    curve = PowerCurve(1.0, 1.0)
+    for day in range(21):
+        start = START + timedelta(days=day)
+        energy = (0.3 + day * 0.037 % 0.2) * MAX_CAPACITY  # Elke dag een andere SoC aan het begin van een blok
+        for hour in range(5):
+            for _ in range(60):
+                # Het schema wordt bij elke SoC-wijziging opnieuw berekend, met de geleerde curve
+                planned = apply_power_curve(
+                    _charge_slots(start, hour), [], energy, MAX_CAPACITY, curve, start + timedelta(hours=6)
+                )
+                if not planned or planned[0]["time"] != start + timedelta(hours=hour):
+                    break
+                commanded = planned[0]["rate"]
+                soc = energy / MAX_CAPACITY
+                power = min(_battery_charge_kw(soc, commanded), (MAX_CAPACITY - energy) * 60)
+                if power <= 0:
+                    break
+                curve.add_sample(soc, -power * 1000, commanded_kw=commanded)
+                energy += power / 60
+
+    # Tot 90% laadt de accu op vol vermogen, dat mag de curve niet afleren
+    assert min(curve.charge[:18]) > 0.95
+    assert 0.5 < curve.charge[18] < 0.9
+    # Het schema blijft de accu tot bijna vol laden
+    planned = apply_power_curve(
+        _charge_slots(START, 0), [], 0.4 * MAX_CAPACITY, MAX_CAPACITY, curve, START + timedelta(hours=6)
+    )
+    assert 0.4 * MAX_CAPACITY + sum(period["energy_kwh"] for period in planned) > 0.95 * MAX_CAPACITY